@@ -0,0 +1,114 @@
+"""
+Compares the URL normalization of the crawl sets before the canonical form
+of lib.canonical, strip().lower(), with the canonical form, on a corpus of
+real-world link variants, and measures the cost of the canonical form with
+and without its LRU memo.
+
+Each link of benchmarks/corpus/link_variants.tsv is labelled with the page
+it points to. A normalization is better when it gives one URL per page:
+more URLs than pages are duplicate fetches of the same page, and pages
+sharing one URL are pages that are never fetched. A lowercased path is
+also a URL that does not exist on case-sensitive servers. Empty path
+segments are kept by the canonical form, so '/docs//guide' remains a
+duplicate of '/docs/guide'.
+
+Usage: python benchmarks/bench_canonical.py [N]   (links canonicalized for the timing, default: 500000)
+"""
+import os
+import re
+import sys
+import time
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.canonical import canonicalize  # noqa: E402
+from lib.canonical import parse_url  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'link_variants.tsv')
+PAGE_URL = 'http://www.example.com/docs/guide/index.html'
+ESCAPE_REGEX = re.compile(r'%[0-9A-Fa-f]{2}')
+
+
+def lowercase(url):
+    """
+    The normalization of the crawl sets before lib.canonical.
+    """
+    return url.strip().lower()
+
+
+def load_corpus():
+    """
+    :return: A list of (page, absolute URL) tuples.
+    """
+    links = []
+    with open(CORPUS, encoding='utf-8') as corpus:
+        for line in corpus:
+            if line.startswith('#') or not line.strip():
+                continue
+            page, href = line.rstrip('\n').split('\t')
+            links.append((page, urljoin(PAGE_URL, href)))
+    return links
+
+
+def path_letters(url):
+    # Letters of the path, the case of the escapes does not matter
+    return ESCAPE_REGEX.sub('', urlsplit(url).path)
+
+
+def evaluate(links, normalize):
+    """
+    :return: A tuple with the number of distinct URLs, the duplicate
+        fetches, the pages merged with another one and the URLs with a
+        changed path case.
+    """
+    urls_of_page = {}
+    pages_of_url = {}
+    broken = 0
+    for page, url in links:
+        normalized = normalize(url)
+        urls_of_page.setdefault(page, set()).add(normalized)
+        pages_of_url.setdefault(normalized, set()).add(page)
+        if path_letters(normalized) != path_letters(canonicalize(url)):
+            broken += 1
+    duplicates = sum(len(urls) - 1 for urls in urls_of_page.values())
+    merged = sum(len(pages) - 1 for pages in pages_of_url.values())
+    return len(pages_of_url), duplicates, merged, broken
+
+
+def timing(links, total):
+    """
+    :return: A dict of the seconds taken to canonicalize total links.
+    """
+    urls = [url for _, url in links]
+    workload = [urls[index % len(urls)] for index in range(total)]
+    results = {}
+    for name, function in (('lower', lowercase),
+                           ('canonical', parse_url.__wrapped__),
+                           ('memoized', parse_url)):
+        parse_url.cache_clear()
+        start = time.perf_counter()
+        for url in workload:
+            function(url)
+        results[name] = time.perf_counter() - start
+    return results
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    links = load_corpus()
+    pages = len({page for page, _ in links})
+    print(f'{len(links)} links to {pages} pages')
+    print(f"{'normalization':>14} {'URLs':>6} {'duplicates':>11} {'merged':>7} {'broken':>7}")
+    for name, normalize in (('lower', lowercase), ('canonical', canonicalize)):
+        urls, duplicates, merged, broken = evaluate(links, normalize)
+        print(f'{name:>14} {urls:>6} {duplicates:>11} {merged:>7} {broken:>7}')
+
+    print(f"\n{'normalization':>14} {'seconds':>8} {'URLs/s':>10}   ({total} links)")
+    for name, elapsed in timing(links, total).items():
+        print(f'{name:>14} {elapsed:>8.2f} {total / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
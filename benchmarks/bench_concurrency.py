@@ -0,0 +1,109 @@
+"""
+Measures the crawl throughput of the asyncio engine for several numbers of
+concurrent workers (-c option), against a local slow site.
+
+A threaded HTTP/1.1 server answers every request after the same delay,
+simulating the latency of a remote host. Its pages form a tree: each page
+links to the next pages, so the frontier grows as the crawl goes, like on
+a real site. The same crawl is run by the whole CrawlEngine at each
+concurrency level.
+
+Usage: python benchmarks/bench_concurrency.py [PAGES [DELAY [LEVELS]]]   (default: 100 0.05 1,4,16)
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.engine import CrawlEngine  # noqa: E402
+from lib.frontier import MemoryFrontier  # noqa: E402
+from lib.utils import add_url_to_queue  # noqa: E402
+from lib.utils import create_parser  # noqa: E402
+
+# Links from each page to the next pages of the tree
+FANOUT = 4
+
+
+def slow_server(pages, delay):
+    """
+    Starts the site server in a thread.
+
+    :return: The port of the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _page(self):
+            try:
+                index = int(self.path.strip('/').replace('page-', '').replace('.html', '') or 0)
+            except ValueError:
+                index = pages
+            children = range(index * FANOUT + 1, min(pages, index * FANOUT + FANOUT + 1))
+            links = ''.join(f'<a href="/page-{child}.html">page {child}</a>' for child in children)
+            return f'<html><body>{links}</body></html>'.encode()
+
+        def _respond(self, send_body):
+            time.sleep(delay)
+            body = self._page()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self._respond(False)
+
+        def do_GET(self):
+            self._respond(True)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def measure(port, concurrency):
+    """
+    Crawls the site with the given number of workers.
+
+    :return: A tuple with the elapsed seconds and the number of crawled pages.
+    """
+    url = f'http://127.0.0.1:{port}/'
+    args = create_parser().parse_args(['-u', url, '-c', str(concurrency)])
+    urls_queued, urls_seen, urls_parsed = MemoryFrontier(), set(), set()
+    add_url_to_queue(url, urls_queued, urls_seen)
+    engine = CrawlEngine(args, 'http', f'127.0.0.1:{port}', urls_queued, urls_seen,
+                         urls_parsed, set(), set(), set(), set())
+    start = time.perf_counter()
+    engine.run()
+    return time.perf_counter() - start, len(urls_parsed)
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    levels = [int(level) for level in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1, 4, 16]
+    logging.basicConfig(level=logging.WARNING)
+
+    port = slow_server(pages, delay)
+    print(f'{pages} pages, {delay * 1000:.0f} ms per response')
+    print(f"{'workers':>8} {'seconds':>8} {'pages/s':>8} {'speedup':>8} {'crawled':>8}")
+    baseline = None
+    for concurrency in levels:
+        elapsed, crawled = measure(port, concurrency)
+        baseline = baseline or elapsed
+        print(f'{concurrency:>8} {elapsed:>8.2f} {crawled / elapsed:>8.1f} {baseline / elapsed:>7.1f}x {crawled:>8}')
+
+
+if __name__ == '__main__':
+    main()
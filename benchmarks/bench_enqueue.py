@@ -0,0 +1,128 @@
+"""
+Measures the per-link cost of the enqueue hot path: from the link found in
+a page to the frontier, the seen-set and the external set.
+
+Three versions of the path are compared on the same synthetic pages:
+
+- lower: each URL is lowercased and validated with urlparse() in every
+  helper, and parsed again for its host, as before lib.canonical,
+- string: canonical URL strings, still parsed again for the host and
+  the validation,
+- record: ParsedUrl records created once by the extractor and passed
+  along, as the crawler does.
+
+Each page has links to the pages of its menu, repeated on every page, links
+to new pages and a few external links, like the pages of a real site.
+
+Usage: python benchmarks/bench_enqueue.py [PAGES [LINKS]]   (default: 2000 100)
+"""
+import os
+import sys
+import time
+from urllib.parse import urljoin
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.canonical import canonicalize  # noqa: E402
+from lib.canonical import parse_url  # noqa: E402
+from lib.frontier import MemoryFrontier  # noqa: E402
+from lib.utils import add_url_to_queue  # noqa: E402
+from lib.utils import add_url_to_set  # noqa: E402
+
+BASE_URL = 'www.example.com'
+BASE_FULL_URL = f'http://{BASE_URL}'
+
+
+def synthetic_links(page, links):
+    """
+    Returns the hrefs of a page: one third menu, one third new pages and
+    the rest split between assets and external links.
+    """
+    hrefs = [f'/menu/section-{index}/' for index in range(links // 3)]
+    hrefs += [f'/articles/{page}/item-{index}.html?ref=list#comments' for index in range(links // 3)]
+    hrefs += [f'https://cdn.example.org/assets/{index % 20}.js' for index in range(links - 2 * (links // 3))]
+    return hrefs
+
+
+def is_valid_url(url):
+    parsed = urlparse(url)
+    return bool(parsed.scheme) and bool(parsed.netloc)
+
+
+def extract_strings(hrefs, normalize):
+    return {normalize(urljoin(BASE_FULL_URL, href)): 'anchor' for href in hrefs}
+
+
+def enqueue_strings(found, queue, seen, extern, normalize):
+    for url, kind in found.items():
+        if url not in seen:
+            if BASE_URL in urlparse(url).netloc:
+                url = normalize(url)
+                if is_valid_url(url):
+                    seen.add(url)
+                    queue.append(url, 1)
+                continue
+            url = normalize(url)
+            if is_valid_url(url) and url not in extern:
+                extern.add(url)
+
+
+def extract_records(hrefs):
+    return {parse_url(urljoin(BASE_FULL_URL, href)): 'anchor' for href in hrefs}
+
+
+def enqueue_records(found, queue, seen, extern):
+    for link, kind in found.items():
+        if link.url not in seen:
+            if BASE_URL in link.netloc:
+                add_url_to_queue(link, queue, seen, 1)
+                continue
+            add_url_to_set(link, extern)
+
+
+def lowercase(url):
+    return url.strip().lower()
+
+
+def measure(name, pages, links):
+    """
+    Runs the extraction and the enqueue of all the pages.
+
+    :return: A tuple with the seconds spent extracting, the seconds spent
+        enqueueing and the number of queued URLs.
+    """
+    parse_url.cache_clear()
+    queue, seen, extern = MemoryFrontier(), set(), set()
+    hrefs_of_pages = [synthetic_links(page, links) for page in range(pages)]
+    normalize = lowercase if name == 'lower' else canonicalize
+    extracting = enqueueing = 0
+    for hrefs in hrefs_of_pages:
+        start = time.perf_counter()
+        if name == 'record':
+            found = extract_records(hrefs)
+        else:
+            found = extract_strings(hrefs, normalize)
+        extracted = time.perf_counter()
+        if name == 'record':
+            enqueue_records(found, queue, seen, extern)
+        else:
+            enqueue_strings(found, queue, seen, extern, normalize)
+        extracting += extracted - start
+        enqueueing += time.perf_counter() - extracted
+    return extracting, enqueueing, len(queue)
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    links = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    total = pages * links
+    print(f'{pages} pages, {links} links per page')
+    print(f"{'path':>8} {'extract ns/link':>16} {'enqueue ns/link':>16} {'queued':>8}")
+    for name in ('lower', 'string', 'record'):
+        extracting, enqueueing, queued = measure(name, pages, links)
+        print(f'{name:>8} {extracting / total * 1e9:>16.0f} {enqueueing / total * 1e9:>16.0f} {queued:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Compares the HTTP/1.1 connection pools of the crawl session with the
+HTTP/2 transport of lib.http2, fetching pages from local test servers.
+
+Two servers answer every request with the same small HTML page after the
+same delay, simulating the latency of a remote host: a threaded HTTP/1.1
+server, and a cleartext HTTP/2 server (h2c, used with prior knowledge)
+built on the h2 library. N pages are fetched with fetch_website() by T
+threads, like the fetch threads of the crawl engine.
+
+Needs httpx[http2].
+
+Usage: python benchmarks/bench_http2.py [N [T [DELAY]]]   (default: 2000 20 0.02)
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.http2 import HTTP2_AVAILABLE  # noqa: E402
+from lib.session import create_session  # noqa: E402
+from lib.fetch_website import fetch_website  # noqa: E402
+
+PAGE = b'<html><body>' + b''.join(b'<a href="/page-%i.html">page %i</a>' % (i, i) for i in range(20)) + b'</body></html>'
+
+
+def http1_server(delay):
+    """
+    Starts the HTTP/1.1 server in a thread.
+
+    :return: The port of the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+async def _h2_connection(reader, writer, delay):
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+    connection.initiate_connection()
+    writer.write(connection.data_to_send())
+
+    async def respond(stream_id):
+        await asyncio.sleep(delay)
+        connection.send_headers(stream_id, [(':status', '200'),
+                                            ('content-type', 'text/html'),
+                                            ('content-length', str(len(PAGE)))])
+        connection.send_data(stream_id, PAGE, end_stream=True)
+        writer.write(connection.data_to_send())
+
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        for event in connection.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                asyncio.ensure_future(respond(event.stream_id))
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                writer.close()
+                return
+        writer.write(connection.data_to_send())
+    writer.close()
+
+
+def http2_server(delay):
+    """
+    Starts the h2c server on an event loop in a thread.
+
+    :return: The port of the server.
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(
+            asyncio.start_server(lambda reader, writer: _h2_connection(reader, writer, delay), sock=sock))
+        loop.run_until_complete(server.serve_forever())
+
+    threading.Thread(target=run, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def measure(port, total, threads, http2):
+    """
+    Fetches total pages with the given number of threads.
+
+    :return: A tuple with the elapsed seconds, the connections opened and
+        the number of failed fetches.
+    """
+    session = create_session(pool_hosts=1, pool_maxsize=threads, http2=http2, h2c=http2)
+    urls = [f'http://127.0.0.1:{port}/page-{index}.html' for index in range(total)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        responses = list(executor.map(lambda url: fetch_website(session, url, send_head=False), urls))
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for response in responses if response.status_code != 200 or response.content != PAGE)
+    opened = session.connection_stats.opened
+    session.close()
+    return elapsed, opened, failed
+
+
+def main():
+    if not HTTP2_AVAILABLE:
+        sys.exit('This benchmark needs httpx[http2]: pip install httpx[http2]')
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+
+    ports = {'HTTP/1.1': http1_server(delay), 'HTTP/2': http2_server(delay)}
+    print(f'{total} pages, {threads} threads, {delay * 1000:.0f} ms per response')
+    print(f"{'transport':>10} {'seconds':>8} {'pages/s':>8} {'connections':>12} {'failed':>7}")
+    for name, port in ports.items():
+        elapsed, opened, failed = measure(port, total, threads, name == 'HTTP/2')
+        print(f'{name:>10} {elapsed:>8.2f} {total / elapsed:>8.0f} {opened:>12} {failed:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares the link extractor backends of lib.parse_website.
+
+First checks that every backend finds the same links on the golden corpus
+in benchmarks/corpus, then reports pages/sec and peak memory of each backend
+on synthetic pages of increasing size.
+
+Usage: python benchmarks/bench_parsers.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.parse_website import PARSERS  # noqa: E402
+from lib.parse_website import find_all_links  # noqa: E402
+
+CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+BASE_SCHEME = 'http'
+BASE_URL = 'www.example.com'
+
+
+def load_corpus():
+    """
+    Returns the golden corpus as a list of (file name, content bytes).
+    """
+    corpus = []
+    for file_name in sorted(os.listdir(CORPUS_DIRECTORY)):
+        with open(os.path.join(CORPUS_DIRECTORY, file_name), 'rb') as file:
+            corpus.append((file_name, file.read()))
+    return corpus
+
+
+def check_corpus(corpus):
+    """
+    Checks that all the backends agree with the bs4 backend on every page.
+
+    :return: True if all the backends agree.
+    """
+    all_agree = True
+    for file_name, content in corpus:
+        expected = find_all_links(content, BASE_SCHEME, BASE_URL, 'bs4')
+        for parser in PARSERS:
+            found = find_all_links(content, BASE_SCHEME, BASE_URL, parser)
+            if found != expected:
+                all_agree = False
+                print(f'MISMATCH {parser} on {file_name}:')
+                print(f'  missing: {sorted(link.url for link in expected.keys() - found.keys())}')
+                print(f'  extra:   {sorted(link.url for link in found.keys() - expected.keys())}')
+    return all_agree
+
+
+def synthetic_page(links):
+    """
+    Builds an HTML page with the given number of links and some markup around them.
+    """
+    rows = ''.join(f'<tr><td class="c{i % 7}"><a href="/path/{i}?q={i}&amp;x=1">link {i}</a></td>'
+                   f'<td><span>Some text for row {i}</span></td></tr>\n' for i in range(links))
+    return f'<html><head><title>Bench</title></head><body><table>{rows}</table></body></html>'.encode()
+
+
+def bench(parser, page, repeat):
+    """
+    Parses the page repeatedly with the given backend.
+
+    :return: A tuple with pages/sec and peak memory in Kb.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        find_all_links(page, BASE_SCHEME, BASE_URL, parser)
+    pages_per_second = repeat / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    find_all_links(page, BASE_SCHEME, BASE_URL, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pages_per_second, peak / 1024
+
+
+def main():
+    corpus = load_corpus()
+    if not check_corpus(corpus):
+        sys.exit(1)
+    print(f'Golden corpus: {len(corpus)} pages, all backends agree\n')
+
+    print(f"{'links':>8} {'size Kb':>8} {'parser':>8} {'pages/sec':>10} {'peak Kb':>10}")
+    for links, repeat in ((100, 200), (1000, 30), (10000, 3)):
+        page = synthetic_page(links)
+        for parser in PARSERS:
+            pages_per_second, peak = bench(parser, page, repeat)
+            print(f'{links:>8} {len(page) / 1024:>8.1f} {parser:>8} {pages_per_second:>10.1f} {peak:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Measures the time the fetch threads spend logging their requests, with
+the background writer of lib.request_log and with a synchronous writer
+formatting and writing each line in the fetch thread, as the v1 crawler did.
+
+Slow storage is emulated by a delay on each write to the log file, so the
+synchronous writer holds the fetch threads on the disk, while the
+background writer pays the delay once per batch of lines.
+
+Usage: python benchmarks/bench_request_log.py [THREADS [REQUESTS [DELAY_MS]]]   (default: 8 500 1)
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+from datetime import timedelta
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.request_log import RequestLog  # noqa: E402
+
+
+class SlowFile:
+    """
+    File wrapper sleeping on each write, like a loaded disk or a network share.
+    """
+
+    def __init__(self, file, delay):
+        self.file = file
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SyncRequestLog(RequestLog):
+    """
+    Writes each line from the calling thread, under a lock.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._write_lock = threading.Lock()
+
+    def log_response(self, response, *args, **kwargs):
+        request = response.request
+        entry = (time.time(), request.method, request.url, 'HTTP/1.1', response.status_code,
+                 len(response.content), request.headers.get('Referer'), request.headers.get('User-Agent'))
+        with self._write_lock:
+            self._file.write(self.format_line(entry) + '\n')
+            self._file.flush()
+            self.logged += 1
+
+
+def synthetic_response(index):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Length'] = '5120'
+    response.elapsed = timedelta(milliseconds=20)
+    response._content = b''
+    response.request = requests.Request('GET', f'http://www.example.com/articles/{index}.html',
+                                        headers={'User-Agent': 'python-requests'}).prepare()
+    return response
+
+
+def measure(log, threads, total):
+    """
+    :return: A tuple with the mean and the maximum microseconds of a
+        logging call, and the seconds until all the lines are written.
+    """
+    responses = [synthetic_response(index) for index in range(total)]
+    timings = [[] for _ in range(threads)]
+
+    def fetch_thread(number):
+        for response in responses:
+            start = time.perf_counter()
+            log.log_response(response)
+            timings[number].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=fetch_thread, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    log.close()
+    elapsed = time.perf_counter() - start
+    calls = [timing for thread_timings in timings for timing in thread_timings]
+    return sum(calls) / len(calls) * 1e6, max(calls) * 1e6, elapsed
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    delay = (float(sys.argv[3]) if len(sys.argv) > 3 else 1) / 1000
+    print(f'{threads} threads, {total} requests each, {delay * 1000:g} ms per write')
+    print(f"{'writer':>12} {'mean us/call':>13} {'max us/call':>12} {'total s':>8} {'logged':>8} {'dropped':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, log_class in (('synchronous', SyncRequestLog), ('background', RequestLog)):
+            log = log_class(os.path.join(directory, f'{name}.log'), log_format='combined',
+                            queue_size=threads * total)
+            log._file = SlowFile(log._file, delay)
+            mean, highest, elapsed = measure(log, threads, total)
+            print(f'{name:>12} {mean:>13.1f} {highest:>12.0f} {elapsed:>8.2f} {log.logged:>8} {log.dropped:>8}')
+
+
+if __name__ == '__main__':
+    main()
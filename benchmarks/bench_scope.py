@@ -0,0 +1,87 @@
+"""
+Measures the throughput of the scope matcher of lib.scope, and compares
+its classification with the substring test it replaced, `base_url in netloc`.
+
+The links are spread over the crawled site and its subdomains, external
+hosts, and lookalike hosts containing the name of the site, and some paths
+are excluded by the rules. The matcher is measured with the decisions of
+the hosts cached, as in a crawl where the hosts repeat, and with every
+host new.
+
+Usage: python benchmarks/bench_scope.py [N]   (default: 200000)
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.canonical import parse_url  # noqa: E402
+from lib.scope import ScopeMatcher  # noqa: E402
+
+BASE_URL = 'example.com'
+RULES = {
+    'allow_hosts': [BASE_URL, 'example-cdn.net'],
+    'deny_hosts': ['ads.example.com', 'tracker.example-cdn.net'],
+    'deny_paths': ['/private/*', '*.zip', '/cart/*'],
+    'deny_regexes': [r'[?&](sessionid|sid)=', r'/calendar/\d{4}/'],
+}
+
+
+def synthetic_links(total, unique_hosts=False):
+    """
+    :return: A list of (ParsedUrl, in scope) tuples.
+    """
+    rng = random.Random(42)
+    links = []
+    for index in range(total):
+        suffix = f'-{index}' if unique_hosts else f'-{index % 50}'
+        kind = rng.random()
+        if kind < 0.5:
+            host, in_scope = rng.choice(['example.com', 'www.example.com', f'blog{suffix}.example.com']), True
+        elif kind < 0.6:
+            host, in_scope = f'static{suffix}.example-cdn.net', True
+        elif kind < 0.65:
+            host, in_scope = rng.choice(['ads.example.com', 'x.tracker.example-cdn.net']), False
+        elif kind < 0.75:
+            host, in_scope = rng.choice([f'example.com.attacker{suffix}.net', f'evil-example.com{suffix}.org',
+                                         f'notexample.com{suffix}.io']), False
+        else:
+            host, in_scope = f'site{suffix}.org', False
+        path = rng.choice(['/articles/%i.html' % index, '/private/%i' % index, '/files/%i.zip' % index,
+                           '/search?q=%i&sessionid=abc' % index, '/calendar/2024/%i' % index,
+                           '/blog/post-%i?page=2' % index, '/'])
+        if path.startswith(('/private/', '/files/', '/calendar/')) or 'sessionid' in path:
+            in_scope = False
+        links.append((parse_url(f'https://{host}{path}'), in_scope))
+    return links
+
+
+def measure(function, links):
+    """
+    :return: A tuple with the links classified per second and the number of
+        wrong classifications.
+    """
+    start = time.perf_counter()
+    decisions = [function(link) for link, _ in links]
+    elapsed = time.perf_counter() - start
+    wrong = sum(1 for decision, (_, in_scope) in zip(decisions, links) if decision != in_scope)
+    return len(links) / elapsed, wrong
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f'{total} links')
+    print(f"{'classifier':>22} {'links/s':>10} {'wrong':>8}")
+    for name, unique_hosts in (('repeated hosts', False), ('new hosts', True)):
+        links = synthetic_links(total, unique_hosts)
+        matcher = ScopeMatcher(**RULES)
+        rate, wrong = measure(lambda link: BASE_URL in link.netloc, links)
+        print(f"{'substring':>22} {rate:>10.0f} {wrong:>8}")
+        rate, wrong = measure(matcher.in_scope, links)
+        print(f"{'matcher, ' + name:>22} {rate:>10.0f} {wrong:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the memory used by the crawl sets as Python sets and as the
+compact URL store of lib.url_store.
+
+Simulates the end of a crawl of N synthetic URLs: every URL is seen,
+90% were parsed, 10% are still queued and 5% are files. Like in the
+crawler, each URL is canonicalized before it is added to a set, and the
+LRU cache of lib.canonical hands the same string to the sets of a URL.
+
+Usage: python benchmarks/bench_url_store.py [N ...]   (default: 1000000)
+"""
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.canonical import canonicalize  # noqa: E402
+from lib.url_store import UrlStore  # noqa: E402
+from lib.url_store import UrlSet  # noqa: E402
+from lib.url_store import UrlQueue  # noqa: E402
+
+
+def synthetic_url(index):
+    """
+    Returns a URL of realistic length for the given index.
+    """
+    return f'https://www.example.com/section-{index % 97}/articles/{index // 97}/page-{index}.html?ref=nav'
+
+
+def fill(urls_seen, urls_parsed, urls_queued, urls_files, total):
+    for index in range(total):
+        url = synthetic_url(index)
+        urls_seen.add(canonicalize(url))
+        if index % 10 == 0:
+            urls_queued.append(canonicalize(url))
+        else:
+            urls_parsed.add(canonicalize(url))
+        if index % 20 == 0:
+            urls_files.add(canonicalize(url))
+
+
+def measure(name, total):
+    """
+    Fills the crawl containers of the given kind and measures their memory.
+
+    :return: A tuple with the memory in Mb and the elapsed seconds.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    if name == 'set':
+        containers = (set(), set(), deque(), set())
+    else:
+        store = UrlStore()
+        containers = (UrlSet(store), UrlSet(store), UrlQueue(store), UrlSet(store))
+    fill(*containers, total)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del containers
+    return current / 1024 / 1024, elapsed
+
+
+def main():
+    totals = [int(arg) for arg in sys.argv[1:]] or [1000000]
+    print(f"{'URLs':>10} {'store':>8} {'memory Mb':>10} {'bytes/URL':>10} {'seconds':>8}")
+    for total in totals:
+        for name in ('set', 'compact'):
+            memory, elapsed = measure(name, total)
+            print(f'{total:>10} {name:>8} {memory:>10.1f} {memory * 1024 * 1024 / total:>10.1f} {elapsed:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
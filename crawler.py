@@ -8,20 +8,40 @@ obtain all the structure of a website, including files.
 
 import os
 import re
+import sys
 import pickle
 import logging
-from collections import deque
 from urllib.parse import urlparse
-import requests
-from requests.exceptions import ConnectionError
-from lib.fetch_website import fetch_website
-from lib.parse_website import find_all_links
+from lib.engine import CrawlEngine
+from lib.url_store import UrlStore
+from lib.url_store import UrlSet
+from lib.url_store import UrlQueue
+from lib.seen_filter import BloomFilter
+from lib.seen_filter import load_seen_filter
+from lib.frontier import DiskFrontier
+from lib.frontier import MemoryFrontier
+from lib.journal import Journal
+from lib.journal import JournaledSet
+from lib.journal import JournaledQueue
+from lib.journal import replay_journal
+from lib.sqlite_state import SqliteState
+from lib.sqlite_state import query_urls
+from lib.sqlite_state import SEEN, PARSED, FAILED, EXTERN, ERRORS, FILES
+from lib.recrawl import RecrawlStore
+from lib.response_cache import ResponseCache
+from lib.http2 import HTTP2_AVAILABLE
+from lib.canonical import canonicalize
+from lib.export import create_exporter
+from lib.export import is_file_result
+from lib.export import PARQUET_AVAILABLE
+from lib.request_log import RequestLog
 from lib.utils import store_set_to_file
 from lib.utils import load_set_from_file
 from lib.utils import load_queue_from_file
-from lib.utils import add_url_to_set
+from lib.utils import load_parents_from_file
 from lib.utils import add_url_to_queue
 from lib.utils import create_parser
+from lib.utils import create_query_parser
 
 
 def setup_logging(verbose, debug, url):
@@ -55,22 +75,138 @@ def setup_logging(verbose, debug, url):
     console_handler.setFormatter(console_formatter)
     logger.addHandler(console_handler)
 
-def main():
+def store_session(args, base_url, urls_queued, urls_seen, urls_parsed, urls_failed, urls_extern, urls_errors, urls_files):
     """
-    Main function for the crawler program. Parses command line arguments and starts the crawling process.
+    Stores the crawl state to disk, so that the session can be resumed.
     """
-    parser = create_parser()
-    args = parser.parse_args()
+    if args.frontier == 'disk':
+        urls_queued.save()
+    else:
+        store_set_to_file(urls_queued, 'logs', f'{base_url}_urls_queued')
+    store_set_to_file(urls_parsed, 'logs', f'{base_url}_urls_parsed')
+    store_set_to_file(urls_failed, 'logs', f'{base_url}_urls_failed')
+    store_set_to_file(urls_errors, 'logs', f'{base_url}_urls_errors')
+    store_set_to_file(urls_extern, 'logs', f'{base_url}_urls_extern')
+    store_set_to_file(urls_files, 'logs', f'{base_url}_urls_files')
+    if args.seen_filter == 'bloom':
+        store_set_to_file(urls_seen, 'logs', f'{base_url}_urls_seen')
+
 
+def open_session(args, base_url):
+    """
+    Creates the frontier and the URL sets of the crawl, loading them from the
+    session files and the journal when resuming.
+
+    :return: A tuple (urls_queued, urls_seen, urls_parsed, urls_failed, urls_extern, urls_errors, urls_files, journal).
+    """
     urls_parsed = set()
-    urls_queued = deque()
+    urls_queued = MemoryFrontier()
     urls_failed = set()
     urls_extern = set()
     urls_errors = set()
     urls_files = set()
     urls_seen = set()
 
-    total_content_size = 0
+    if args.seen_filter == 'bloom':
+        # Fixed memory dedupe check, saved with the rest of the session
+        if args.resume:
+            urls_seen = load_seen_filter(f"logs/{base_url}_urls_seen.log", args.seen_capacity, args.seen_fp_rate)
+        else:
+            urls_seen = BloomFilter(args.seen_capacity, args.seen_fp_rate)
+        logging.info('Using a bloom seen-filter of %.2f Mb for %i URLs at %g false positive rate',
+                     urls_seen.size / 1024 / 1024, urls_seen.capacity, urls_seen.fp_rate)
+
+    if args.frontier == 'disk':
+        # Keep the head of the queue in memory and the tail in segment files
+        urls_queued = DiskFrontier(f"logs/{base_url}_frontier",
+                                   memory_limit=args.frontier_memory,
+                                   segment_size=args.frontier_segment,
+                                   resume=args.resume)
+
+    # Check if the session needs to be resumed or else start from scratch
+    if args.resume:
+        urls_parsed = load_set_from_file(f"logs/{base_url}_urls_parsed.log", urls_seen)
+        urls_failed = load_set_from_file(f"logs/{base_url}_urls_failed.log", urls_seen)
+        urls_extern = load_set_from_file(f"logs/{base_url}_urls_extern.log", urls_seen)
+        urls_errors = load_set_from_file(f"logs/{base_url}_urls_errors.log", urls_seen)
+        urls_files = load_set_from_file(f"logs/{base_url}_urls_files.log", urls_seen)
+        if args.frontier == 'memory':
+            urls_queued = load_queue_from_file(f"logs/{base_url}_urls_queued.log", urls_seen)
+        else:
+            # The queued URLs are seen, like those of a loaded memory frontier
+            for url in urls_queued:
+                urls_seen.add(url)
+
+    if args.url_store == 'compact':
+        # Intern every URL once and keep only IDs in the sets and the queue
+        url_store = UrlStore()
+        if args.seen_filter == 'exact':
+            urls_seen = UrlSet(url_store, urls_seen)
+        urls_parsed = UrlSet(url_store, urls_parsed)
+        urls_failed = UrlSet(url_store, urls_failed)
+        urls_extern = UrlSet(url_store, urls_extern)
+        urls_errors = UrlSet(url_store, urls_errors)
+        urls_files = UrlSet(url_store, urls_files)
+        if args.frontier == 'memory':
+            urls_queued = UrlQueue(url_store, urls_queued.entries())
+
+    journal = None
+    if args.journal:
+        journal_file = f"logs/{base_url}_journal.log"
+        state = (args, base_url, urls_queued, urls_seen, urls_parsed, urls_failed, urls_extern, urls_errors, urls_files)
+        journal = Journal(journal_file,
+                          batch_size=args.journal_batch,
+                          compact_every=args.journal_compact,
+                          on_compact=lambda: store_session(*state))
+        if args.resume:
+            # The snapshot is the state at the last compaction, the journal has
+            # the rest and goes on, until it is long enough to be compacted
+            replayed = replay_journal(journal_file, urls_queued, urls_seen, {
+                'parsed': urls_parsed,
+                'failed': urls_failed,
+                'extern': urls_extern,
+                'errors': urls_errors,
+                'files': urls_files,
+            }, journal)
+            journal.events += replayed
+            logging.info('Replayed %i events from the journal', replayed)
+        else:
+            # Start from an empty snapshot and an empty journal
+            journal.compact()
+
+        urls_queued = JournaledQueue(urls_queued, journal)
+        urls_parsed = JournaledSet(urls_parsed, journal, 'parsed')
+        urls_failed = JournaledSet(urls_failed, journal, 'failed')
+        urls_extern = JournaledSet(urls_extern, journal, 'extern')
+        urls_errors = JournaledSet(urls_errors, journal, 'errors')
+        urls_files = JournaledSet(urls_files, journal, 'files')
+
+    return urls_queued, urls_seen, urls_parsed, urls_failed, urls_extern, urls_errors, urls_files, journal
+
+
+def query(argv):
+    """
+    Query subcommand: lists the URLs of a crawl stored with --state sqlite.
+    """
+    args = create_query_parser().parse_args(argv)
+    base_url = urlparse(canonicalize(args.url)).netloc
+    rows = query_urls(f"logs/{base_url}_state.db",
+                      status=args.status,
+                      content_type=args.content_type,
+                      min_size=args.min_size,
+                      max_size=args.max_size,
+                      http_status=args.http_status)
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def main():
+    """
+    Main function for the crawler program. Parses command line arguments and starts the crawling process.
+    """
+    parser = create_parser()
+    args = parser.parse_args()
+    args.url = canonicalize(args.url)
 
     # Parse the URL to get the base url and scheme
     # which will be used to store data and reconstruct
@@ -80,14 +216,38 @@ def main():
 
     setup_logging(args.verbose, args.debug, base_url)
 
-    # Check if the session needs to be resumed or else start from scratch
+    if args.http2 and not HTTP2_AVAILABLE:
+        logging.error('HTTP/2 needs the httpx package with its http2 extra: pip install httpx[http2]. Exiting.')
+        return
+
+    if (args.write or args.export_file_list) and args.export_format == 'parquet' and not PARQUET_AVAILABLE:
+        logging.error('The parquet export needs the pyarrow package: pip install pyarrow. Exiting.')
+        return
+
+    for regex in (args.allow_regex or []) + (args.deny_regex or []):
+        try:
+            re.compile(regex)
+        except re.error as err:
+            logging.error('Invalid scope regular expression %s (%s). Exiting.', regex, err)
+            return
+
+    sqlite_state = None
+    journal = None
+    if args.state == 'sqlite':
+        # The sets are views on the database, nothing is loaded in memory
+        sqlite_state = SqliteState(f"logs/{base_url}_state.db", resume=args.resume, batch_size=args.state_batch)
+        urls_queued = sqlite_state.queue
+        urls_seen = sqlite_state.sets[SEEN]
+        urls_parsed = sqlite_state.sets[PARSED]
+        urls_failed = sqlite_state.sets[FAILED]
+        urls_extern = sqlite_state.sets[EXTERN]
+        urls_errors = sqlite_state.sets[ERRORS]
+        urls_files = sqlite_state.sets[FILES]
+    else:
+        (urls_queued, urls_seen, urls_parsed, urls_failed,
+         urls_extern, urls_errors, urls_files, journal) = open_session(args, base_url)
+
     if args.resume:
-        urls_parsed = load_set_from_file(f"logs/{base_url}_urls_parsed.log", urls_seen)
-        urls_failed = load_set_from_file(f"logs/{base_url}_urls_failed.log", urls_seen)
-        urls_extern = load_set_from_file(f"logs/{base_url}_urls_extern.log", urls_seen)
-        urls_errors = load_set_from_file(f"logs/{base_url}_urls_errors.log", urls_seen)
-        urls_files = load_set_from_file(f"logs/{base_url}_urls_files.log", urls_seen)
-        urls_queued = load_queue_from_file(f"logs/{base_url}_urls_queued.log", urls_seen)
         logging.info('Resuming web crawling session: Crawled: %i, Queued: %i, Failed: %i, Files: %i, External: %i, Errors: %i',
                      len(urls_parsed),
                      len(urls_queued),
@@ -102,110 +262,110 @@ def main():
         logging.info('Web crawling starting on base URL %s (%s)', args.url, base_url)
 
 
-    # Limit the URLs processed according to the input limit
-    while len(urls_parsed) <= args.crawl_limit and len(urls_queued) > 0:
-        # Create one session to run all the HTTP requests through it
-        with requests.Session() as session:
-            try:
-                # Breadth-first search
-                current_url = urls_queued.popleft()
-                add_url_to_set(current_url, urls_seen)
-
-                # Default size if there's no content
-                content_size_kb = 0
-
-                try:
-                    # Crawl URL
-                    response = fetch_website(session, current_url, args.username, args.password)
-                except ConnectionError:
-                    add_url_to_queue(current_url, urls_queued, urls_seen)
-                    logging.error('Error fetching the website. Connectivity issues. Stopping. Resume with --resume')
-                    break
-
-                if not response or not response.ok:
-                    # If response is not ok, mark URL as failed
-                    add_url_to_set(current_url, urls_failed)
-                    continue
-
-                # Depending on the response status, store the URL in the correct set.
-                # We are here if response is ok
-                add_url_to_set(current_url, urls_parsed)
-
-                try:
-                    total_content_size += len(response.content)
-                    content_size_kb = len(response.content) / 1024
-                except:
-                    # If we cannot calculate the size, do nothing.
-                    pass
-
-                logging.info('CRAWLED - %s - %s - %.2f Kb', current_url, response.status_code, content_size_kb)
-
-                if response.headers.get('Location', None) is not None:
-                    redirection_url = response.headers.get('Location', None)
-                    if redirection_url not in urls_seen:
-                        add_url_to_queue(redirection_url, urls_queued, urls_seen)
-                        continue
-
-                # Only parse the HTML responses, ignore the rest.
-                content_type = response.headers.get('Content-Type', '').lower()
-                if 'text/html' not in content_type:
-                    add_url_to_set(current_url, urls_files)
-                    logging.debug('FILES - %s', current_url)
-                    continue
-
-                # Parse the response content to find all outlinks from the HTML reponse
-                try:
-                    found_urls = find_all_links(response.content, base_scheme, base_url)
-                    logging.debug('Found %i new URLs', len(found_urls))
-                except Exception as err:
-                    logging.error('Exception found in find_all_links(): %s', err)
-                    continue
-
-                for new_url in found_urls:
-                    # Only process those URLs that have not been parsed
-                    if new_url not in urls_seen:
-                        found_base_url = urlparse(new_url).netloc
-                        if base_url in found_base_url:
-                            add_url_to_queue(new_url, urls_queued, urls_seen)
-                            logging.debug('FETCHED - %s', new_url)
-                            continue
-
-                        # Other links are external
-                        add_url_to_set(new_url, urls_extern)
-                        logging.debug('EXTERNAL - %s', new_url)
-
-            except KeyboardInterrupt:
-                add_url_to_queue(current_url, urls_queued, urls_seen)
-                break
-            except Exception as err:
-                logging.error('Error processing URL: %s (%s)', current_url, err)
-                urls_errors.add(current_url)
-                continue
+    engine = CrawlEngine(args, base_scheme, base_url, urls_queued, urls_seen,
+                         urls_parsed, urls_failed, urls_extern, urls_errors, urls_files)
+    if sqlite_state is not None:
+        engine.result_listeners.append(sqlite_state.record_result)
+    exporters = []
+    if args.write:
+        exporters.append(create_exporter(f"logs/{base_url}_results", args.export_format,
+                                         args.export_compression, args.export_buffer, append=args.resume))
+    if args.export_file_list:
+        exporters.append(create_exporter(f"logs/{base_url}_files", args.export_format,
+                                         args.export_compression, args.export_buffer, accept=is_file_result,
+                                         append=args.resume))
+    if exporters:
+        engine.result_listeners.extend(exporters)
+        # Parents of the URLs queued by the previous run, for their results
+        engine.parents = load_parents_from_file(f"logs/{base_url}_parents.log") if args.resume else {}
+    if args.common_log_format:
+        engine.request_log = RequestLog(f"logs/{base_url}_requests.log",
+                                        log_format=args.log_format,
+                                        queue_size=args.log_queue,
+                                        username=args.username)
+    if args.cache:
+        # Shared by all the crawls, whatever the site
+        engine.response_cache = ResponseCache("logs/response_cache.db", ttl=args.cache_ttl, max_size=args.cache_size)
+    if args.recrawl:
+        # Kept from one crawl to the next, unlike the session files
+        engine.recrawl = RecrawlStore(f"logs/{base_url}_recrawl.db", batch_size=args.state_batch)
+    try:
+        # Limit the URLs processed according to the input limit
+        engine.run()
+    except KeyboardInterrupt:
+        logging.info('Crawling interrupted by the user. Resume with --resume')
+    total_content_size = engine.total_content_size
+    for exporter in exporters:
+        exporter.close()
+    if engine.parents is not None:
+        # Not journaled, a killed crawl resumes with the parents stored by the run before it
+        store_set_to_file(engine.parents, 'logs', f'{base_url}_parents')
+    if engine.request_log is not None:
+        # Writes the lines still queued, those of an interrupted crawl too
+        engine.request_log.close()
 
 
     # Log summary of the results
-    logging.info('SUMMARY - Crawled: %i, Queued: %i, Failed: %i, Files: %i, External: %i, Errors: %i, Total downloaded: %.2f Kb',
+    logging.info('SUMMARY - Crawled: %i, Queued: %i, Failed: %i, Files: %i, External: %i, Errors: %i, Total downloaded: %.2f Kb, Wire: %.2f Kb, DNS hits: %i, DNS misses: %i',
                  len(urls_parsed),
                  len(urls_queued),
                  len(urls_failed),
                  len(urls_files),
                  len(urls_extern),
                  len(urls_errors),
-                 total_content_size/1024
+                 total_content_size/1024,
+                 engine.total_wire_size/1024,
+                 engine.dns_cache.hits if engine.dns_cache is not None else 0,
+                 engine.dns_cache.misses if engine.dns_cache is not None else 0
                  )
+    if engine.session is not None:
+        logging.info('CONNECTIONS - Opened: %i, Reused: %i',
+                     engine.session.connection_stats.opened,
+                     engine.session.connection_stats.reused
+                     )
+    if engine.request_log is not None:
+        logging.info('REQUESTS - Logged: %i, Dropped: %i',
+                     engine.request_log.logged,
+                     engine.request_log.dropped
+                     )
+    if engine.response_cache is not None:
+        logging.info('CACHE - Hits: %i, Misses: %i, Size: %.2f Mb',
+                     engine.response_cache.hits,
+                     engine.response_cache.misses,
+                     engine.response_cache.size / 1024 / 1024
+                     )
+        engine.response_cache.close()
+    if engine.recrawl is not None:
+        logging.info('RECRAWL - Not modified: %i, Same content: %i',
+                     engine.unchanged,
+                     engine.same_content
+                     )
+        engine.recrawl.close()
+    for host, state in engine.scheduler.state().items():
+        logging.info('POLITENESS - %s - Requests: %i, Throughput: %.2f req/s, Rate: %.2f req/s, Ceiling: %.2f req/s, Throttled: %i',
+                     host,
+                     state['requests'],
+                     state['throughput'],
+                     state['rate'],
+                     state['ceiling'],
+                     state['throttled']
+                     )
 
-    # Store sets to disk
-    store_set_to_file(urls_queued, 'logs', f'{base_url}_urls_queued')
-    store_set_to_file(urls_parsed, 'logs', f'{base_url}_urls_parsed')
-    store_set_to_file(urls_failed, 'logs', f'{base_url}_urls_failed')
-    store_set_to_file(urls_errors, 'logs', f'{base_url}_urls_errors')
-    store_set_to_file(urls_extern, 'logs', f'{base_url}_urls_extern')
-    store_set_to_file(urls_files, 'logs', f'{base_url}_urls_files')
-
+    if sqlite_state is not None:
+        sqlite_state.close()
+    elif journal is not None:
+        # The state is already on disk: last snapshot plus the journal tail
+        journal.close()
+    else:
+        # Store sets to disk
+        store_session(args, base_url, urls_queued, urls_seen, urls_parsed, urls_failed, urls_extern, urls_errors, urls_files)
 
 if __name__ == "__main__":
     try:
-        main()
+        if len(sys.argv) > 1 and sys.argv[1] == 'query':
+            query(sys.argv[2:])
+        else:
+            main()
     except FileNotFoundError:
         logging.error('No session to resume from. Exiting.')
     except pickle.UnpicklingError:
@@ -0,0 +1,195 @@
+"""
+Canonical form of the URLs stored in the frontier and the crawl sets.
+
+Variants of the same URL found in pages must be stored once, or the same
+page is fetched many times. The canonical form:
+
+- lowercases the scheme and the host, and removes the default port,
+- keeps the case of the path and the query, which are case sensitive,
+- removes the '.' and '..' path segments, and the empty path becomes '/',
+- decodes the percent-encoded unreserved characters, uppercases the other
+  escapes and encodes the characters that are not allowed unescaped,
+- sorts the query parameters by name, keeping the order of repeated names,
+- drops the fragment, which is never sent to the server.
+
+Links repeat a lot across the pages of a site (menus, footers, assets), so
+the canonical form of the latest URLs and of the scheme and host prefixes
+are memoized in LRU caches.
+
+parse_url() returns the canonical URL as a ParsedUrl record, with the parts
+the crawler checks, so a link is parsed once when it is found and not again
+on its way to the frontier and the crawl sets.
+"""
+import re
+from functools import lru_cache
+from urllib.parse import quote
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+# Characters left unescaped in each component, besides the unreserved ones
+PATH_SAFE = "/:@!$&'()*+,;="
+QUERY_SAFE = PATH_SAFE + '?'
+URL_CACHE_SIZE = 1 << 16
+PREFIX_CACHE_SIZE = 1 << 12
+
+ESCAPE_REGEX = re.compile(r'%([0-9A-Fa-f]{2})')
+STRAY_PERCENT_REGEX = re.compile(r'%(?![0-9A-Fa-f]{2})')
+
+
+@lru_cache(maxsize=None)
+def _unsafe_regex(safe):
+    # Matches the characters to escape in a component
+    return re.compile('[^%s]' % re.escape(''.join(sorted(UNRESERVED)) + safe + '%'))
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group(1), 16))
+    return char if char in UNRESERVED else '%' + match.group(1).upper()
+
+
+def normalize_encoding(component, safe):
+    """
+    Normalizes the percent-encoding of a URL component.
+
+    :param component: Path or query of a URL.
+    :param safe: Reserved characters left unescaped.
+    :return: The component, with a single encoding for each character.
+    """
+    if '%' in component:
+        component = STRAY_PERCENT_REGEX.sub('%25', component)
+        component = ESCAPE_REGEX.sub(_normalize_escape, component)
+    if _unsafe_regex(safe).search(component) is None:
+        return component
+    return quote(component, safe=safe + '%')
+
+
+def remove_dot_segments(path):
+    """
+    Removes the '.' and '..' segments of a path (RFC 3986, section 5.2.4).
+    """
+    if '/.' not in path:
+        return path
+    segments = path.split('/')
+    output = []
+    for segment in segments[1:] if path.startswith('/') else segments:
+        if segment == '..':
+            if output:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    # A path ending with a dot segment is a directory
+    if segments[-1] in ('.', '..'):
+        output.append('')
+    return ('/' if path.startswith('/') else '') + '/'.join(output)
+
+
+def sort_query(query):
+    """
+    Sorts the parameters of a query by name. The sort is stable, so
+    parameters with the same name keep their order.
+    """
+    if '&' not in query:
+        return query
+    parameters = [parameter for parameter in query.split('&') if parameter]
+    parameters.sort(key=lambda parameter: parameter.split('=', 1)[0])
+    return '&'.join(parameters)
+
+
+@lru_cache(maxsize=PREFIX_CACHE_SIZE)
+def canonical_netloc(scheme, netloc):
+    """
+    Returns the canonical network location of a URL: lowercase host
+    without its trailing dot, and no default port.
+
+    :raise ValueError: if the port is not a number.
+    """
+    userinfo, _, hostport = netloc.rpartition('@')
+    host, port = hostport, None
+    if hostport.startswith('['):
+        # IPv6 address
+        end = hostport.find(']')
+        if end != -1 and hostport[end + 1:end + 2] == ':':
+            host, port = hostport[:end + 1], hostport[end + 2:]
+    elif ':' in hostport:
+        host, _, port = hostport.rpartition(':')
+    host = host.lower().rstrip('.')
+    if port is not None:
+        if port and not port.isdigit():
+            raise ValueError(f'Invalid port in {netloc}')
+        if not port or int(port) == DEFAULT_PORTS.get(scheme):
+            port = None
+    if port is not None:
+        host = f'{host}:{int(port)}'
+    return f'{userinfo}@{host}' if userinfo else host
+
+
+class ParsedUrl:
+    """
+    A canonical URL with its scheme and network location. Records compare
+    and hash like their URL, to be used as keys of the found links.
+    """
+
+    __slots__ = ('url', 'scheme', 'netloc', 'valid')
+
+    def __init__(self, url, scheme='', netloc='', valid=False):
+        """
+        :param url: The canonical URL.
+        :param scheme: Its lowercase scheme.
+        :param netloc: Its canonical network location.
+        :param valid: True if the URL is absolute, with a scheme and a network location.
+        """
+        self.url = url
+        self.scheme = scheme
+        self.netloc = netloc
+        self.valid = valid
+
+    def __eq__(self, other):
+        if isinstance(other, ParsedUrl):
+            return self.url == other.url
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.url)
+
+    def __repr__(self):
+        return f'ParsedUrl({self.url!r})'
+
+    def __reduce__(self):
+        return ParsedUrl, (self.url, self.scheme, self.netloc, self.valid)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def parse_url(url):
+    """
+    Parses a URL into a ParsedUrl record of its canonical form. URLs that
+    are not absolute, or cannot be parsed, are only stripped of their
+    surrounding whitespace, and are not valid.
+
+    :param url: The URL, absolute for it to be canonicalized.
+    :return: A ParsedUrl object.
+    """
+    url = url.strip()
+    try:
+        scheme, netloc, path, query, _ = urlsplit(url)
+        scheme = scheme.lower()
+        if not scheme or not netloc:
+            return ParsedUrl(url, scheme, netloc)
+        netloc = canonical_netloc(scheme, netloc)
+    except ValueError:
+        return ParsedUrl(url)
+    # Decoded first, as '%2E' is a dot too
+    path = remove_dot_segments(normalize_encoding(path, PATH_SAFE)) or '/'
+    query = sort_query(normalize_encoding(query, QUERY_SAFE)) if query else ''
+    return ParsedUrl(urlunsplit((scheme, netloc, path, query, '')), scheme, netloc, True)
+
+
+def canonicalize(url):
+    """
+    Returns the canonical form of a URL, see parse_url().
+
+    :param url: The URL, absolute for it to be canonicalized.
+    :return: The canonical URL.
+    """
+    return parse_url(url).url
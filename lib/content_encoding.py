@@ -0,0 +1,129 @@
+"""
+Content-Encoding negotiation and streaming decompression of page bodies.
+
+The crawler asks for the encodings it can decode, and decodes streamed
+bodies itself, so that the bytes received on the wire and the decoded
+bytes can be counted apart, and a decompression bomb can be stopped
+before it is expanded.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Largest piece of decoded data produced at once
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+class ZlibDecoder:
+    """
+    Incremental gzip or deflate decoder producing bounded pieces of output.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._decompressor = self._new_decompressor()
+        self._first_data = encoding == 'deflate'
+
+    def _new_decompressor(self):
+        if self.encoding == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return zlib.decompressobj()
+
+    def decode(self, data):
+        """
+        Decodes a chunk of the body.
+
+        :param data: Encoded bytes as received.
+        :return: A generator of decoded pieces of at most DECODE_CHUNK_SIZE bytes.
+        """
+        if self._first_data:
+            # Some servers send raw deflate data without the zlib header
+            self._first_data = False
+            try:
+                zlib.decompressobj().decompress(data[:64])
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while data:
+            yield self._decompressor.decompress(data, DECODE_CHUNK_SIZE)
+            data = self._decompressor.unconsumed_tail
+            if not data and self._decompressor.eof and self._decompressor.unused_data:
+                # Next member of a multi-member gzip body
+                data = self._decompressor.unused_data
+                self._decompressor = self._new_decompressor()
+
+    def flush(self):
+        """
+        Returns the decoded data still buffered at the end of the body.
+        """
+        return self._decompressor.flush()
+
+
+class BrotliDecoder:
+    """
+    Incremental brotli decoder. The brotli bindings have no output limit,
+    so each piece is the output of one received chunk.
+    """
+
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decode(self, data):
+        """
+        Decodes a chunk of the body.
+
+        :param data: Encoded bytes as received.
+        :return: A generator of decoded pieces.
+        """
+        decompress = getattr(self._decompressor, 'process', None) or self._decompressor.decompress
+        yield decompress(data)
+
+    def flush(self):
+        """
+        Returns the decoded data still buffered at the end of the body.
+        """
+        return b''
+
+
+class IdentityDecoder:
+    """
+    Decoder of the bodies without a supported Content-Encoding.
+    """
+
+    def decode(self, data):
+        yield data
+
+    def flush(self):
+        return b''
+
+
+def accept_encoding():
+    """
+    Returns the Accept-Encoding header value listing the supported encodings.
+    """
+    encodings = ['gzip', 'deflate']
+    if brotli is not None:
+        encodings.append('br')
+    return ', '.join(encodings)
+
+
+def create_decoder(content_encoding):
+    """
+    Creates the decoder of a Content-Encoding header value.
+
+    :param content_encoding: The header value, e.g. 'gzip', or None.
+    :return: An object with decode(data) and flush() methods.
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return ZlibDecoder('gzip')
+    if encoding == 'deflate':
+        return ZlibDecoder('deflate')
+    if encoding == 'br' and brotli is not None:
+        return BrotliDecoder()
+    return IdentityDecoder()
@@ -0,0 +1,152 @@
+"""
+Crawl-wide cache of DNS resolutions.
+
+Every new connection resolves its host name, and a crawl fanning out to
+many subdomains repeats the same blocking lookups. The cache replaces
+socket.getaddrinfo while the crawl runs, so the HTTP/1.1 pools, the HTTP/2
+transport and the robots.txt and sitemap fetches all share it. Failed
+lookups are cached too, for a shorter time.
+
+The system resolver does not report the TTL of the records, so entries
+expire after a configured TTL, which should not exceed the one of the
+crawled zones.
+"""
+import time
+import socket
+import asyncio
+import ipaddress
+import threading
+from urllib.parse import urlparse
+from urllib3.util.connection import allowed_gai_family
+
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 60
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class DnsCache:
+    """
+    Thread-safe cache of getaddrinfo() results, with positive and negative
+    TTLs. Use install() and uninstall() to route the lookups of the process
+    through it. Misses count the lookups sent to the system resolver, hits
+    the ones answered from the cache, except the first answer after a
+    prefetch, which only hands over the lookup counted as a miss.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """
+        :param ttl: Seconds a successful resolution is reused.
+        :param negative_ttl: Seconds a failed resolution is reused.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._pending = {}
+        # Keys resolved by prefetch() and not looked up by a fetch yet
+        self._prefetched = set()
+        self._lock = threading.Lock()
+        self._getaddrinfo = socket.getaddrinfo
+
+    def install(self):
+        """
+        Replaces socket.getaddrinfo with the cached lookup.
+        """
+        self._getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        """
+        Restores the socket.getaddrinfo replaced by install().
+        """
+        if socket.getaddrinfo == self.getaddrinfo:
+            socket.getaddrinfo = self._getaddrinfo
+
+    def _cached(self, key, count=True):
+        # Returns the (result, error) entry of a key if it did not expire
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            if count:
+                if key in self._prefetched:
+                    self._prefetched.discard(key)
+                else:
+                    self.hits += 1
+            return entry[1], entry[2]
+
+    def _resolve(self, key, prefetched=False):
+        # Looks a key up with the system resolver and stores the outcome
+        with self._lock:
+            self.misses += 1
+        try:
+            result = self._getaddrinfo(*key)
+        except socket.gaierror as err:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.negative_ttl, None, err)
+                if prefetched:
+                    self._prefetched.add(key)
+            raise
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result, None)
+            if prefetched:
+                self._prefetched.add(key)
+        return result
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """
+        Drop-in replacement of socket.getaddrinfo() answering from the cache.
+        """
+        if isinstance(host, bytes):
+            # Some clients pass the IDNA encoded name
+            host = host.decode('ascii')
+        if host is None or _is_ip_address(host):
+            return self._getaddrinfo(host, port, family, type, proto, flags)
+        key = (host, port, family, type, proto, flags)
+        cached = self._cached(key)
+        if cached is None:
+            return self._resolve(key)
+        result, error = cached
+        if error is not None:
+            raise socket.gaierror(error.errno, error.strerror)
+        return result
+
+    async def prefetch(self, url):
+        """
+        Resolves the host of a URL without blocking the event loop, the way
+        the connection pools will look it up, so that the fetch threads find
+        it in the cache. Concurrent prefetches of a host share one lookup.
+        Resolution errors are left to the fetch.
+
+        :param url: The URL about to be fetched.
+        """
+        parsed = urlparse(url)
+        host = parsed.hostname
+        if not host or _is_ip_address(host):
+            return
+        try:
+            port = parsed.port or DEFAULT_PORTS.get(parsed.scheme)
+        except ValueError:
+            return
+        key = (host, port, allowed_gai_family(), socket.SOCK_STREAM, 0, 0)
+        if self._cached(key, count=False) is not None:
+            return
+
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = self._pending[key] = loop.run_in_executor(None, self._resolve, key, True)
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        try:
+            await asyncio.shield(pending)
+        except socket.gaierror:
+            pass
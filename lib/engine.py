@@ -0,0 +1,476 @@
+"""
+Asyncio crawl engine running a bounded pool of concurrent workers
+against a shared frontier and seen-set.
+"""
+import asyncio
+import signal
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+from requests.exceptions import ConnectionError
+from lib.fetch_website import fetch_website
+from lib.fetch_website import HeadPredictor
+from lib.fetch_website import body_pending
+from lib.fetch_website import read_body
+from lib.session import create_session
+from lib.dns_cache import DnsCache
+from lib.canonical import parse_url
+from lib.scope import create_scope
+from lib.politeness import PolitenessScheduler
+from lib.politeness import MAX_THROTTLED_RETRIES
+from lib.robots import RobotsCache
+from lib.robots import product_token
+from lib.robots import sitemap_urls
+from lib.recrawl import content_hash
+from lib.recrawl import content_hasher
+from lib.parse_website import find_all_links
+from lib.parse_website import StreamingLinkExtractor
+from lib.utils import add_url_to_set
+from lib.utils import add_url_to_queue
+
+# Pending URLs whose parent is kept for the export, the later ones are exported without it
+PARENTS_SIZE = 100000
+
+def _init_parser_process():
+    # CTRL-C is handled by the main process, parser workers just exit with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class CrawlEngine:
+    """
+    Runs N fetch/parse workers concurrently. The blocking HTTP requests are
+    executed in a thread pool, while all the bookkeeping on the frontier and
+    the URL sets happens on the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, args, base_scheme, base_url, urls_queued, urls_seen,
+                 urls_parsed, urls_failed, urls_extern, urls_errors, urls_files):
+        """
+        :param args: Parsed command line arguments.
+        :param base_scheme: Scheme of the root URL, used to rebuild relative URLs.
+        :param base_url: Network location of the root URL.
+        :param urls_queued: Frontier of (url, depth) entries shared by all the workers.
+        :param urls_seen: Set of URLs already queued or crawled.
+        :param urls_parsed: Set of URLs crawled successfully.
+        :param urls_failed: Set of URLs with a non-ok response.
+        :param urls_extern: Set of URLs outside of the base URL.
+        :param urls_errors: Set of URLs that raised an error while processing.
+        :param urls_files: Set of URLs with non-HTML content.
+        """
+        self.args = args
+        self.base_scheme = base_scheme
+        self.base_url = base_url
+        self.urls_queued = urls_queued
+        self.urls_seen = urls_seen
+        self.urls_parsed = urls_parsed
+        self.urls_failed = urls_failed
+        self.urls_extern = urls_extern
+        self.urls_errors = urls_errors
+        self.urls_files = urls_files
+        self.concurrency = max(1, getattr(args, 'concurrency', 1))
+        self.crawl_depth = getattr(args, 'crawl_depth', float('inf'))
+        self.scope = create_scope(base_url, args)
+        self.total_content_size = 0
+        self.total_wire_size = 0
+        self.in_flight = 0
+        self.stopped = False
+        self.head_mode = getattr(args, 'head_mode', 'always')
+        self.head_predictor = HeadPredictor()
+        self.parser = getattr(args, 'parser', 'bs4')
+        self.parse_workers = getattr(args, 'parse_workers', 0)
+        self.parse_queue = getattr(args, 'parse_queue', None) or 2 * max(1, self.parse_workers)
+        self.max_page_size = getattr(args, 'max_page_size', None)
+        self.max_compression_ratio = getattr(args, 'max_compression_ratio', None)
+        # The streaming extractor is fed with the chunks as they are read
+        self.stream_parse = self.parser == 'stream' and self.parse_workers == 0
+        self.scheduler = PolitenessScheduler(rate=getattr(args, 'rate', None),
+                                             burst=getattr(args, 'burst', 1),
+                                             latency_target=getattr(args, 'latency_target', 1.0))
+        # Times each throttled URL was put back in the frontier
+        self.retries = {}
+        self.obey_robots = getattr(args, 'robots', 'ignore') == 'obey'
+        self.use_sitemaps = getattr(args, 'sitemaps', False)
+        self.robots = None
+        self._robots_loads = {}
+        # RecrawlStore of the previous crawls, set for conditional recrawls
+        self.recrawl = None
+        # ResponseCache answering the requests of the crawl, if enabled
+        self.response_cache = None
+        # RequestLog writing a line per HTTP request, if enabled
+        self.request_log = None
+        self.unchanged = 0
+        dns_ttl = getattr(args, 'dns_ttl', 0)
+        self.dns_cache = DnsCache(dns_ttl, getattr(args, 'dns_negative_ttl', 60)) if dns_ttl > 0 else None
+        self.same_content = 0
+        # Functions called with a dict describing the response of each URL
+        self.result_listeners = []
+        # Dict of the queued URLs to the page they were found in, set to track them
+        self.parents = None
+        self.session = None
+        self._executor = None
+        self._parser_pool = None
+        self._parse_slots = None
+        self._wakeup = None
+
+    def run(self):
+        """
+        Runs the crawl until the frontier is exhausted, the crawl limit is
+        reached or the crawl is stopped. On CTRL-C the URLs being fetched are
+        put back in the queue and KeyboardInterrupt is propagated.
+        """
+        asyncio.run(self._run())
+
+    async def _run(self):
+        if self.dns_cache is not None:
+            self.dns_cache.install()
+        # One session and connection pool for the whole crawl, so that
+        # connections are kept alive and reused across URLs.
+        self.session = create_session(pool_hosts=getattr(self.args, 'pool_hosts', 10),
+                                      pool_maxsize=getattr(self.args, 'pool_maxsize', None) or self.concurrency,
+                                      keep_alive=not getattr(self.args, 'no_keep_alive', False),
+                                      cache=self.response_cache,
+                                      http2=getattr(self.args, 'http2', False),
+                                      h2c=getattr(self.args, 'h2c', False))
+        if self.request_log is not None:
+            self.session.hooks['response'].append(self.request_log.log_response)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        if self.parse_workers > 0:
+            self._parser_pool = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                    initializer=_init_parser_process)
+            # Backpressure: bounds the number of raw pages waiting to be parsed
+            self._parse_slots = asyncio.Semaphore(self.parse_queue)
+        self._wakeup = asyncio.Event()
+        if self.obey_robots or self.use_sitemaps:
+            self.robots = RobotsCache(self.session, product_token(self.session.headers.get('User-Agent', '*')))
+        try:
+            if self.use_sitemaps and not getattr(self.args, 'resume', False):
+                # Nothing else runs yet, so the frontier can be filled from here
+                self._seed_from_sitemaps()
+            workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            await asyncio.gather(*workers)
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            if self._parser_pool is not None:
+                self._parser_pool.shutdown(cancel_futures=True)
+            self.session.close()
+            if self.dns_cache is not None:
+                self.dns_cache.uninstall()
+
+    def _can_take_more(self):
+        # Fetches in flight count against the limit, so that N workers
+        # do not overshoot the crawl limit by N-1 URLs.
+        return len(self.urls_parsed) + self.in_flight <= self.args.crawl_limit
+
+    async def _worker(self):
+        while not self.stopped:
+            if not self.urls_queued or not self._can_take_more():
+                if self.in_flight == 0:
+                    break
+                # Other workers may still add URLs to the frontier
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Breadth-first search
+            current_url, depth = self.urls_queued.popleft_entry()
+            add_url_to_set(current_url, self.urls_seen)
+
+            self.in_flight += 1
+            try:
+                await self._crawl_url(current_url, depth)
+            except asyncio.CancelledError:
+                add_url_to_queue(current_url, self.urls_queued, self.urls_seen, depth)
+                raise
+            except Exception as err:
+                logging.error('Error processing URL: %s (%s)', current_url, err)
+                self.urls_errors.add(current_url)
+            finally:
+                self.in_flight -= 1
+                self._wakeup.set()
+
+            # Journaled and SQLite frontiers record when a URL is completely processed
+            task_done = getattr(self.urls_queued, 'task_done', None)
+            if task_done is not None:
+                task_done(current_url)
+
+    def _seed_from_sitemaps(self):
+        origin = f'{self.base_scheme}://{self.base_url}'
+        rules = self.robots.get(origin) or self.robots.load(origin)
+        if self.crawl_depth < 1:
+            return
+        seeded = 0
+        for url in sitemap_urls(self.session, rules.sitemaps or [f'{origin}/sitemap.xml']):
+            link = parse_url(url)
+            if link.url in self.urls_seen or not self.scope.in_scope(link):
+                continue
+            if self.obey_robots and not self.robots.get(RobotsCache.origin(link.url), rules).allowed(link.url):
+                continue
+            # As if the sitemap was a page linked from the root URL
+            add_url_to_queue(link, self.urls_queued, self.urls_seen, 1)
+            seeded += 1
+        logging.info('Seeded %i URLs from the sitemaps', seeded)
+
+    async def _robots_allow(self, url):
+        origin = RobotsCache.origin(url)
+        rules = self.robots.get(origin)
+        if rules is None:
+            # Workers finding links to the same new host share one fetch
+            load = self._robots_loads.get(origin)
+            if load is None:
+                loop = asyncio.get_running_loop()
+                load = self._robots_loads[origin] = loop.run_in_executor(self._executor, self.robots.load, origin)
+            rules = await load
+        return rules.allowed(url)
+
+    async def _find_links(self, content):
+        if self._parser_pool is None:
+            return find_all_links(content, self.base_scheme, self.base_url, self.parser)
+
+        # The fetcher waits here while the parse stage is full, so that no
+        # more pages are held in memory than the stage can take.
+        async with self._parse_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._parser_pool, find_all_links,
+                                              content, self.base_scheme, self.base_url, self.parser)
+
+    def _send_head(self, url):
+        if self.head_mode == 'auto':
+            return self.head_predictor.should_send_head(url)
+        return self.head_mode == 'always'
+
+    def _fetch(self, url, send_head, headers=None):
+        """
+        Fetches a URL and reads its body, in a thread of the pool.
+
+        :return: A tuple (response, body). body is None when the response
+            was complete without reading a stream, or else a dict with the
+            decoded 'size' read, the 'wire_size' received, the content
+            'hash' for recrawls and the 'links' found while streaming (None
+            if the body must still be parsed).
+        """
+        response = fetch_website(self.session, url, self.args.username, self.args.password,
+                                 send_head, headers, stream_body=True)
+        if not body_pending(response):
+            return response, None
+
+        consumers = []
+        hasher = content_hasher() if self.recrawl is not None else None
+        if hasher is not None:
+            consumers.append(hasher.update)
+        # Set by the response cache on the responses it has to store
+        store_body = getattr(response, 'store_body', None)
+        chunks = []
+        if self.stream_parse:
+            extractor = StreamingLinkExtractor(f"{self.base_scheme}://{self.base_url}")
+            consumers.append(extractor.feed)
+        if not self.stream_parse or store_body is not None:
+            consumers.append(chunks.append)
+
+        size, wire_size, stopped = read_body(response, self.max_page_size, consumers,
+                                             max_ratio=self.max_compression_ratio)
+        if stopped == 'max_size':
+            logging.warning('TRUNCATED - %s - larger than %i bytes', url, self.max_page_size)
+        elif stopped == 'max_ratio':
+            logging.warning('DECOMPRESSION BOMB - %s - expands more than %i times, dropped after %i bytes',
+                            url, self.max_compression_ratio, size)
+
+        if store_body is not None and stopped is None:
+            # Only complete bodies are stored
+            store_body(b''.join(chunks))
+
+        body = {'size': size,
+                'wire_size': wire_size,
+                'hash': hasher.digest() if hasher is not None else None,
+                'links': None}
+        if stopped == 'max_ratio':
+            # Nothing of a decompression bomb is worth parsing
+            body['links'] = {}
+        elif self.stream_parse:
+            body['links'] = extractor.close()
+        else:
+            response._content = b''.join(chunks)
+        return response, body
+
+    @staticmethod
+    def _conditional_headers(page):
+        headers = {}
+        if page['etag']:
+            headers['If-None-Match'] = page['etag']
+        if page['last_modified']:
+            headers['If-Modified-Since'] = page['last_modified']
+        return headers
+
+    def _notify_result(self, url, response, size, depth):
+        if not size:
+            # Bodies that were not downloaded are sized from the headers
+            try:
+                size = int(response.headers.get('Content-Length', 0))
+            except ValueError:
+                size = 0
+        result = {
+            'url': url,
+            'http_status': response.status_code,
+            'content_type': response.headers.get('Content-Type', ''),
+            'size': size,
+            'elapsed': response.elapsed.total_seconds() if response.status_code else None,
+            'depth': depth,
+            'parent': self.parents.pop(url, None) if self.parents is not None else None,
+        }
+        for listener in self.result_listeners:
+            listener(result)
+
+    def _record_parent(self, url, parent):
+        """
+        Remembers the page a queued URL was found in, for its result. The
+        first PARENTS_SIZE pending URLs are kept, which are crawled first.
+
+        :param url: The queued URL.
+        :param parent: URL of the page linking or redirecting to it.
+        """
+        if self.parents is not None and len(self.parents) < PARENTS_SIZE:
+            self.parents[url] = parent
+
+    async def _crawl_url(self, current_url, depth):
+        loop = asyncio.get_running_loop()
+
+        # Default size if there's no content
+        content_size_kb = 0
+
+        # The page as of the previous crawl, if it was HTML then
+        previous = self.recrawl.get(current_url) if self.recrawl is not None else None
+
+        host = urlparse(current_url).netloc
+        await self.scheduler.acquire(host)
+        if self.dns_cache is not None:
+            # Resolve on the event loop, the fetch thread then finds the host in the cache
+            await self.dns_cache.prefetch(current_url)
+        try:
+            # Crawl URL, skipping the HEAD request of the pages known to be HTML
+            if previous is not None:
+                response, body = await loop.run_in_executor(self._executor, self._fetch, current_url,
+                                                            False, self._conditional_headers(previous))
+            else:
+                response, body = await loop.run_in_executor(self._executor, self._fetch, current_url,
+                                                            self._send_head(current_url))
+        except ConnectionError:
+            add_url_to_queue(current_url, self.urls_queued, self.urls_seen, depth)
+            if not self.stopped:
+                logging.error('Error fetching the website. Connectivity issues. Stopping. Resume with --resume')
+            self.stopped = True
+            return
+
+        elapsed = response.elapsed.total_seconds() if response.status_code else None
+        if self.scheduler.record(host, response.status_code, response.headers.get('Retry-After'), elapsed):
+            retries = self.retries.get(current_url, 0)
+            if retries < MAX_THROTTLED_RETRIES:
+                # Try again later, the scheduler already slowed the host down
+                self.retries[current_url] = retries + 1
+                add_url_to_queue(current_url, self.urls_queued, self.urls_seen, depth)
+                logging.info('THROTTLED - %s - %s - retry %i', current_url, response.status_code, retries + 1)
+                return
+        self.retries.pop(current_url, None)
+
+        # Byte count of the body, as read from the stream
+        if body is not None:
+            body_size = body['size']
+        else:
+            body_size = len(response.content or b'') if response.status_code else 0
+
+        if self.result_listeners:
+            self._notify_result(current_url, response, body_size, depth)
+
+        if not response or not response.ok:
+            # If response is not ok, mark URL as failed
+            add_url_to_set(current_url, self.urls_failed)
+            return
+
+        # Depending on the response status, store the URL in the correct set.
+        # We are here if response is ok
+        add_url_to_set(current_url, self.urls_parsed)
+
+        self.total_content_size += body_size
+        if body is not None:
+            self.total_wire_size += body['wire_size']
+        content_size_kb = body_size / 1024
+
+        logging.info('CRAWLED - %s - %s - %.2f Kb', current_url, response.status_code, content_size_kb)
+
+        if response.headers.get('Location', None) is not None:
+            redirection = parse_url(response.headers.get('Location', None))
+            if redirection.url not in self.urls_seen:
+                if self.scope.in_scope(redirection):
+                    # A redirection is the same page, not one more link away
+                    add_url_to_queue(redirection, self.urls_queued, self.urls_seen, depth)
+                    self._record_parent(redirection.url, current_url)
+                    return
+                add_url_to_set(redirection, self.urls_extern)
+
+        if response.status_code == 304 and previous is not None:
+            # Not modified since the previous crawl, reuse its outlinks
+            self.unchanged += 1
+            found_urls = previous['outlinks']
+            logging.debug('UNCHANGED - %s', current_url)
+        else:
+            # Only parse the HTML responses, ignore the rest.
+            content_type = response.headers.get('Content-Type', '').lower()
+            self.head_predictor.observe(current_url, content_type)
+            if 'text/html' not in content_type:
+                add_url_to_set(current_url, self.urls_files)
+                logging.debug('FILES - %s', current_url)
+                return
+
+            if body is not None:
+                page_hash = body['hash']
+            else:
+                page_hash = content_hash(response.content) if self.recrawl is not None else None
+            if previous is not None and previous['content_hash'] == page_hash:
+                # Same content without validators, no need to parse it again
+                self.same_content += 1
+                found_urls = previous['outlinks']
+                logging.debug('UNCHANGED - %s (same content)', current_url)
+            elif body is not None and body['links'] is not None:
+                # Already parsed while the body was streamed
+                found_urls = body['links']
+                logging.debug('Found %i new URLs', len(found_urls))
+            else:
+                # Parse the response content to find all outlinks from the HTML reponse
+                try:
+                    found_urls = await self._find_links(response.content)
+                    logging.debug('Found %i new URLs', len(found_urls))
+                except Exception as err:
+                    logging.error('Exception found in find_all_links(): %s', err)
+                    return
+
+            if self.recrawl is not None:
+                self.recrawl.store(current_url,
+                                   response.headers.get('ETag'),
+                                   response.headers.get('Last-Modified'),
+                                   page_hash,
+                                   found_urls)
+
+        # Outlinks deeper than the crawl depth are dropped here, before
+        # they take any room in the frontier or the seen-set.
+        new_depth = depth + 1
+        in_depth = new_depth <= self.crawl_depth
+        # The links are ParsedUrl records, parsed once by the extractor
+        for link, kind in found_urls.items():
+            # Only process those URLs that have not been parsed
+            if link.url not in self.urls_seen:
+                if self.scope.in_scope(link):
+                    if self.obey_robots and in_depth:
+                        if not await self._robots_allow(link.url):
+                            logging.debug('ROBOTS - %s disallowed', link.url)
+                            continue
+                        # Another worker may have queued it while robots.txt was loading
+                        if link.url in self.urls_seen:
+                            continue
+                    if in_depth:
+                        add_url_to_queue(link, self.urls_queued, self.urls_seen, new_depth)
+                        self._record_parent(link.url, current_url)
+                        logging.debug('FETCHED - %s (%s, depth %i)', link.url, kind, new_depth)
+                    continue
+
+                # Other links are external
+                add_url_to_set(link, self.urls_extern)
+                logging.debug('EXTERNAL - %s (%s)', link.url, kind)
@@ -0,0 +1,202 @@
+"""
+Streaming export of the crawl results.
+
+One record is written per crawled URL, while the crawl runs, so the
+results can be followed live with tail, or read by other tools before
+the crawl ends. Records are buffered and written in batches, and the
+batches are flushed to the file so that a reader never sees half a batch.
+
+JSONL and CSV are written as text, optionally gzipped. Gzip streams are
+flushed at each batch, so `zcat` can read them while they grow. Parquet is
+written one row group per batch, and needs the pyarrow package.
+"""
+import os
+import csv
+import gzip
+import json
+import time
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+PARQUET_AVAILABLE = pyarrow is not None
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+COMPRESSIONS = ('none', 'gzip')
+# Exported columns, and the key of the engine results they come from
+FIELDS = (
+    ('url', 'url'),
+    ('status', 'http_status'),
+    ('content_type', 'content_type'),
+    ('size', 'size'),
+    ('depth', 'depth'),
+    ('latency', 'elapsed'),
+    ('parent', 'parent'),
+)
+
+
+def _text_file_name(file_name, compression):
+    return file_name + '.gz' if compression == 'gzip' else file_name
+
+
+def _open_text(file_name, compression, append):
+    # Appending to a gzip file adds a member, read as one stream by zcat and gzip
+    mode = 'at' if append else 'wt'
+    if compression == 'gzip':
+        return gzip.open(_text_file_name(file_name, compression), mode, encoding='utf-8', newline='')
+    return open(file_name, mode, encoding='utf-8', newline='')
+
+
+class JsonlSink:
+    """
+    Writes the records as JSON objects, one per line.
+    """
+
+    def __init__(self, file_name, compression='none', append=False):
+        self.file = _open_text(file_name, compression, append)
+
+    def write(self, records):
+        self.file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink:
+    """
+    Writes the records as CSV rows, after a header row.
+    """
+
+    def __init__(self, file_name, compression='none', append=False):
+        path = _text_file_name(file_name, compression)
+        new_file = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = _open_text(file_name, compression, append)
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow([name for name, _ in FIELDS])
+
+    def write(self, records):
+        self.writer.writerows([record[name] for name, _ in FIELDS] for record in records)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """
+    Writes the records to a Parquet file, one row group per batch.
+    Parquet files cannot be appended to, so appending writes the next
+    numbered part of the file, e.g. results.1.parquet after results.parquet.
+    """
+
+    def __init__(self, file_name, compression='none', append=False):
+        if append:
+            base, extension = os.path.splitext(file_name)
+            part = 0
+            while os.path.exists(file_name):
+                part += 1
+                file_name = f'{base}.{part}{extension}'
+        self.schema = pyarrow.schema([
+            ('url', pyarrow.string()),
+            ('status', pyarrow.int32()),
+            ('content_type', pyarrow.string()),
+            ('size', pyarrow.int64()),
+            ('depth', pyarrow.int32()),
+            ('latency', pyarrow.float64()),
+            ('parent', pyarrow.string()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema,
+                                                    compression='gzip' if compression == 'gzip' else 'none')
+
+    def write(self, records):
+        columns = {name: [record[name] for record in records] for name, _ in FIELDS}
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+SINKS = {
+    'jsonl': JsonlSink,
+    'csv': CsvSink,
+    'parquet': ParquetSink,
+}
+
+
+class ResultExporter:
+    """
+    Result listener of the crawl engine, writing the results to a sink in
+    batches. A batch is written when it is full, or when a result comes
+    in after flush_interval seconds without a write.
+    """
+
+    def __init__(self, sink, buffer_size=100, flush_interval=1.0, accept=None):
+        """
+        :param sink: JsonlSink, CsvSink or ParquetSink object.
+        :param buffer_size: Number of records written together.
+        :param flush_interval: Maximum seconds a record waits in the buffer,
+            while results keep coming.
+        :param accept: Optional function selecting the results to export.
+        """
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.accept = accept
+        self.exported = 0
+        self._buffer = []
+        self._last_write = time.monotonic()
+
+    def __call__(self, result):
+        if self.accept is not None and not self.accept(result):
+            return
+        self._buffer.append({name: result.get(key) for name, key in FIELDS})
+        if len(self._buffer) >= self.buffer_size or time.monotonic() - self._last_write >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered records.
+        """
+        if self._buffer:
+            self.sink.write(self._buffer)
+            self.exported += len(self._buffer)
+            self._buffer = []
+        self._last_write = time.monotonic()
+
+    def close(self):
+        """
+        Writes the buffered records and closes the sink.
+        """
+        self.flush()
+        self.sink.close()
+
+
+def create_exporter(file_name, export_format='jsonl', compression='none', buffer_size=100, accept=None,
+                    append=False):
+    """
+    Creates a ResultExporter writing to a file.
+
+    :param file_name: File name, without the extension of the format.
+    :param export_format: One of FORMATS.
+    :param compression: One of COMPRESSIONS. Text formats get a '.gz'
+        extension, Parquet files compress their pages.
+    :param buffer_size: Number of records written together.
+    :param accept: Optional function selecting the results to export.
+    :param append: If True, keep the records of a previous run, when resuming.
+    :return: A ResultExporter object.
+    """
+    sink = SINKS[export_format](f'{file_name}.{export_format}', compression, append)
+    return ResultExporter(sink, buffer_size=buffer_size, accept=accept)
+
+
+def is_file_result(result):
+    """
+    Selects the results of the non-HTML files, for the file list export.
+    """
+    status = result.get('http_status') or 0
+    return 200 <= status < 300 and 'text/html' not in (result.get('content_type') or '').lower()
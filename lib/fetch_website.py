@@ -1,13 +1,95 @@
 """
 Connects to a website and retrieves its content.
 """
+import posixpath
+from urllib.parse import urlparse
 import requests
 from requests.models import Response
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import ConnectionError
+from lib.content_encoding import create_decoder
 
 
-def fetch_website(req_session, url, username=None, password=None):
+# Extensions assumed to be HTML or not until the crawl teaches otherwise
+HTML_EXTENSIONS = {'', '.html', '.htm', '.xhtml', '.php', '.asp', '.aspx', '.jsp', '.cgi', '.pl', '.shtml'}
+# Bytes read at once from a streamed body
+CHUNK_SIZE = 64 * 1024
+# Decoded bytes of a body before its compression ratio is checked
+BOMB_MIN_SIZE = 1024 * 1024
+
+FILE_EXTENSIONS = {'.pdf', '.zip', '.gz', '.tgz', '.rar', '.7z', '.tar', '.exe', '.msi', '.dmg', '.iso',
+                   '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp', '.bmp', '.mp3', '.mp4',
+                   '.avi', '.mov', '.mkv', '.wav', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+                   '.css', '.js', '.json', '.xml', '.txt', '.csv', '.woff', '.woff2', '.ttf', '.eot'}
+
+
+class HeadPredictor:
+    """
+    Learns, per file extension and per first path segment, how often a URL
+    turns out to be HTML, and decides whether a HEAD request is worth
+    sending before the GET. A HEAD is only needed to avoid downloading
+    non-HTML bodies, so it is skipped for URLs that are most likely HTML.
+    """
+
+    def __init__(self, min_samples=5, html_ratio=0.9):
+        """
+        :param min_samples: Observations needed before trusting learned stats.
+        :param html_ratio: Fraction of HTML responses above which HEAD is skipped.
+        """
+        self.min_samples = min_samples
+        self.html_ratio = html_ratio
+        self.by_extension = {}
+        self.by_prefix = {}
+
+    @staticmethod
+    def _keys(url):
+        path = urlparse(url).path
+        extension = posixpath.splitext(path.rsplit('/', 1)[-1])[1].lower()
+        prefix = path.lstrip('/').split('/', 1)[0] if '/' in path.lstrip('/') else ''
+        return extension, prefix
+
+    def observe(self, url, content_type):
+        """
+        Records whether the response of a URL was HTML.
+
+        :param url: URL that was fetched.
+        :param content_type: Content-Type header of the response.
+        """
+        is_html = 'text/html' in content_type.lower()
+        extension, prefix = self._keys(url)
+        for stats, key in ((self.by_extension, extension), (self.by_prefix, prefix)):
+            html, total = stats.get(key, (0, 0))
+            stats[key] = (html + is_html, total + 1)
+
+    def _learned(self, stats, key):
+        html, total = stats.get(key, (0, 0))
+        if total < self.min_samples:
+            return None
+        return html / total >= self.html_ratio
+
+    def should_send_head(self, url):
+        """
+        Decides whether to send a HEAD request before fetching a URL.
+
+        :param url: URL to fetch.
+        :return: True if a HEAD request should be sent first.
+        """
+        extension, prefix = self._keys(url)
+        likely_html = self._learned(self.by_extension, extension)
+        if likely_html is None:
+            if extension in FILE_EXTENSIONS:
+                likely_html = False
+            elif extension and extension in HTML_EXTENSIONS:
+                likely_html = True
+            else:
+                # Unknown or no extension: the prefix stats tell more than its name
+                likely_html = self._learned(self.by_prefix, prefix)
+                if likely_html is None:
+                    likely_html = extension in HTML_EXTENSIONS
+        return not likely_html
+
+
+def fetch_website(req_session, url, username=None, password=None, send_head=True, headers=None, stream_body=False):
     """
     Connects to a website and retrieves its content.
 
@@ -15,12 +97,38 @@ def fetch_website(req_session, url, username=None, password=None):
     :param url: URL of the website to connect to.
     :param username: Optional username for basic authentication.
     :param password: Optional password for basic authentication.
+    :param send_head: If False, skip the HEAD request and do a single streamed
+        GET, dropping the body without downloading it when it is not HTML.
+    :param headers: Optional extra headers of the GET request, such as the
+        If-None-Match and If-Modified-Since of a conditional request.
+    :param stream_body: If True, the body of the HTML responses is left unread,
+        to be read with read_body(). The other responses are always complete.
     :return: A response object.
     """
     try:
         # Basic authentication if username and password are provided
         auth = HTTPBasicAuth(username, password) if username and password else None
 
+        if not send_head:
+            response = req_session.get(url,
+                                       auth=auth,
+                                       headers=headers,
+                                       allow_redirects=False,
+                                       verify=False,
+                                       stream=True,
+                                       timeout=5)
+            is_redirect = response.headers.get('Location', None) is not None
+            if is_redirect or 'text/html' not in response.headers.get('Content-Type', ''):
+                # Do not download the body, the response is used like a HEAD one
+                response.close()
+                response._content = b''
+                return response
+
+            # Read the HTML body and release the connection to the pool
+            if not stream_body:
+                response.content
+            return response
+
         # Making a HEAD request to check content type
         head_response = req_session.head(url,
                                          auth=auth,
@@ -37,8 +145,10 @@ def fetch_website(req_session, url, username=None, password=None):
             # Making a GET request if content is HTML
             response = req_session.get(url,
                                        auth=auth,
+                                       headers=headers,
                                        allow_redirects=False,
                                        verify=False,
+                                       stream=stream_body,
                                        timeout=5)
             return response
 
@@ -53,3 +163,64 @@ def fetch_website(req_session, url, username=None, password=None):
         return Response()
     except:
         raise
+
+
+def body_pending(response):
+    """
+    Returns True if the body of a response fetched with stream_body was left
+    unread, and must be read with read_body().
+    """
+    return response.raw is not None and response._content is False
+
+
+def read_body(response, max_size=None, consumers=(), chunk_size=CHUNK_SIZE, max_ratio=None):
+    """
+    Reads the body of a streamed response chunk by chunk, passing every
+    chunk to the consumers instead of keeping the whole body in memory.
+    The body is read as sent on the wire and decoded here from its
+    Content-Encoding, a bounded piece at a time.
+
+    :param response: A response fetched with stream_body.
+    :param max_size: Maximum number of decoded bytes read, the rest of the
+        body is dropped and the connection closed. None for no limit.
+    :param consumers: Functions called with each decoded chunk, in bytes.
+    :param chunk_size: Number of bytes read at once.
+    :param max_ratio: Maximum ratio of decoded to wire bytes. A body
+        expanding more than this past BOMB_MIN_SIZE is a decompression bomb
+        and is dropped. None for no limit.
+    :return: A tuple (size, wire_size, stopped) with the number of decoded
+        bytes read, the number of bytes received, and why the body was not
+        read to its end: None, 'max_size' or 'max_ratio'.
+    """
+    size = 0
+    wire_size = 0
+    stopped = None
+    decoder = create_decoder(response.headers.get('Content-Encoding'))
+
+    def pieces():
+        nonlocal wire_size
+        for data in response.raw.stream(chunk_size, decode_content=False):
+            wire_size += len(data)
+            yield from decoder.decode(data)
+        yield decoder.flush()
+
+    try:
+        for chunk in pieces():
+            if not chunk:
+                continue
+            if max_size is not None and size + len(chunk) > max_size:
+                chunk = chunk[:max_size - size]
+                stopped = 'max_size'
+            elif max_ratio is not None and size + len(chunk) > max(BOMB_MIN_SIZE, wire_size * max_ratio):
+                stopped = 'max_ratio'
+                break
+            size += len(chunk)
+            for consumer in consumers:
+                consumer(chunk)
+            if stopped:
+                break
+    finally:
+        response.close()
+        # The body is gone, response.content must not try to read it again
+        response._content = b''
+    return size, wire_size, stopped
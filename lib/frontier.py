@@ -0,0 +1,238 @@
+"""
+Frontier queues of the crawler. Every entry is a URL and its crawl depth,
+the number of links followed from the root URL to reach it.
+"""
+import os
+import pickle
+from array import array
+from itertools import islice
+from collections import deque
+
+MANIFEST_FILE = 'frontier.index'
+# Depths are stored as unsigned shorts, deeper URLs are clamped
+MAX_DEPTH = 0xffff
+
+
+class MemoryFrontier:
+    """
+    FIFO queue of URLs with their depth. The depths are kept in an array of
+    unsigned shorts next to the deque of URLs, two bytes per entry. Supports
+    the subset of the deque interface used by the crawler.
+    """
+
+    def __init__(self, entries=()):
+        """
+        :param entries: Optional iterable of (url, depth) tuples to append.
+        """
+        self.urls = deque()
+        self.depths = array('H')
+        self.head = 0
+        for url, depth in entries:
+            self.append(url, depth)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __iter__(self):
+        return iter(self.urls)
+
+    def entries(self):
+        """
+        Returns an iterator of the (url, depth) tuples of the queue, in order.
+        """
+        return zip(self.urls, islice(self.depths, self.head, None))
+
+    def append(self, url, depth=0):
+        """
+        Adds a URL at the end of the queue.
+        """
+        self.urls.append(url)
+        self.depths.append(min(depth, MAX_DEPTH))
+
+    def appendleft(self, url, depth=0):
+        """
+        Adds a URL at the front of the queue.
+        """
+        self.urls.appendleft(url)
+        if self.head > 0:
+            self.head -= 1
+            self.depths[self.head] = min(depth, MAX_DEPTH)
+        else:
+            self.depths.insert(0, min(depth, MAX_DEPTH))
+
+    def popleft_entry(self):
+        """
+        Removes the URL at the front of the queue and returns it with its depth.
+        """
+        url = self.urls.popleft()
+        depth = self.depths[self.head]
+        self.head += 1
+        # Drop the consumed depths once they are half of the array
+        if self.head > 1024 and self.head * 2 > len(self.depths):
+            del self.depths[:self.head]
+            self.head = 0
+        return url, depth
+
+    def popleft(self):
+        """
+        Removes and returns the URL at the front of the queue.
+        """
+        return self.popleft_entry()[0]
+
+
+class DiskFrontier:
+    """
+    FIFO queue of URLs with their depth that keeps a hot head in memory and spills the tail
+    to segment files once the head is full. URLs always leave the queue in
+    the order they entered it: head, then segments from oldest to newest,
+    then the tail buffer still being filled. Supports the subset of the
+    deque interface used by the crawler.
+    """
+
+    def __init__(self, directory, memory_limit=100000, segment_size=10000, resume=False):
+        """
+        Opens the frontier stored in the directory.
+
+        :param directory: Directory holding the segment files.
+        :param memory_limit: Maximum number of URLs kept in the in-memory head.
+        :param segment_size: Number of URLs per segment file.
+        :param resume: If True, resume from the segments saved by a previous
+            session, otherwise discard them.
+        """
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.segment_size = segment_size
+        self.head = MemoryFrontier()
+        self.tail = MemoryFrontier()
+        self.segments = deque()
+        self.segment_lengths = {}
+        # Segments read into the head, deleted once a new manifest is saved
+        self.consumed = []
+        self.next_segment = 0
+        self.length = 0
+        os.makedirs(directory, exist_ok=True)
+        if resume:
+            self._load_manifest()
+        else:
+            for name in os.listdir(directory):
+                if name.endswith('.seg') or name == MANIFEST_FILE:
+                    os.remove(self._segment_path(name))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # Segments are read one at a time, the queue is never held in memory
+        yield from self.head
+        for name in list(self.segments):
+            # Lists of URLs or MemoryFrontier objects, both iterate over URLs
+            with open(self._segment_path(name), 'rb') as file:
+                yield from pickle.load(file)
+        yield from self.tail
+
+    def _segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_manifest(self):
+        try:
+            with open(self._segment_path(MANIFEST_FILE), 'rb') as file:
+                manifest = pickle.load(file)
+        except FileNotFoundError:
+            return
+        self.next_segment = manifest['next_segment']
+        for name, length in manifest['segments']:
+            # Segments already consumed by a crashed session are skipped
+            if os.path.exists(self._segment_path(name)):
+                self.segments.append(name)
+                self.segment_lengths[name] = length
+                self.length += length
+
+        # Segments written after the manifest belong to a crashed session
+        for name in os.listdir(self.directory):
+            if name.endswith('.seg') and name not in self.segment_lengths:
+                os.remove(self._segment_path(name))
+
+    def _write_segment(self, frontier):
+        name = f'segment_{self.next_segment:08d}.seg'
+        self.next_segment += 1
+        with open(self._segment_path(name), 'wb') as file:
+            pickle.dump(frontier, file)
+        self.segment_lengths[name] = len(frontier)
+        return name
+
+    def _refill_head(self):
+        # Only called once the head is empty
+        if self.segments:
+            name = self.segments.popleft()
+            with open(self._segment_path(name), 'rb') as file:
+                self.head = pickle.load(file)
+            if isinstance(self.head, list):
+                # Segments written without depths
+                self.head = MemoryFrontier((url, 0) for url in self.head)
+            # Keep the file until the next manifest, the current one still lists it
+            self.consumed.append(name)
+            del self.segment_lengths[name]
+        else:
+            self.head = self.tail
+            self.tail = MemoryFrontier()
+
+    def append(self, url, depth=0):
+        """
+        Adds a URL at the end of the queue.
+        """
+        self.length += 1
+        if not self.segments and not self.tail and len(self.head) < self.memory_limit:
+            self.head.append(url, depth)
+            return
+        self.tail.append(url, depth)
+        if len(self.tail) >= self.segment_size:
+            self.segments.append(self._write_segment(self.tail))
+            self.tail = MemoryFrontier()
+
+    def appendleft(self, url, depth=0):
+        """
+        Adds a URL at the front of the queue.
+        """
+        self.length += 1
+        self.head.appendleft(url, depth)
+
+    def popleft_entry(self):
+        """
+        Removes the URL at the front of the queue and returns it with its depth.
+        """
+        if not self.head:
+            if not self.length:
+                raise IndexError('pop from an empty queue')
+            self._refill_head()
+        self.length -= 1
+        return self.head.popleft_entry()
+
+    def popleft(self):
+        """
+        Removes and returns the URL at the front of the queue.
+        """
+        return self.popleft_entry()[0]
+
+    def save(self):
+        """
+        Writes the whole queue to segment files and a manifest, so that a
+        new DiskFrontier on the same directory resumes from it.
+        """
+        if self.head:
+            # The head goes before all the segments already on disk
+            self.segments.appendleft(self._write_segment(MemoryFrontier(self.head.entries())))
+            self.head = MemoryFrontier()
+        if self.tail:
+            self.segments.append(self._write_segment(self.tail))
+            self.tail = MemoryFrontier()
+        manifest = {
+            'next_segment': self.next_segment,
+            'segments': [(name, self.segment_lengths[name]) for name in self.segments],
+        }
+        with open(self._segment_path(MANIFEST_FILE + '.tmp'), 'wb') as file:
+            pickle.dump(manifest, file)
+        os.replace(self._segment_path(MANIFEST_FILE + '.tmp'), self._segment_path(MANIFEST_FILE))
+
+        for name in self.consumed:
+            os.remove(self._segment_path(name))
+        self.consumed = []
@@ -0,0 +1,217 @@
+"""
+Optional HTTP/2 transport for the crawl session.
+
+Http2Adapter is a requests transport adapter sending the requests through
+an httpx client with HTTP/2 enabled, so that all the fetches to a host
+share one connection as concurrent streams. The fetch layer keeps getting
+requests Response objects, with their status, headers and content.
+
+The connections are driven by an asynchronous client on an event loop
+thread of the adapter: the synchronous HTTP/2 connections of httpx are
+not safe to share between the fetch threads, which would open streams
+out of order.
+
+Needs the httpx package with its http2 extra (pip install httpx[http2]).
+"""
+import time
+import asyncio
+import threading
+from datetime import timedelta
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from requests.exceptions import ConnectionError
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import ConnectTimeout
+from requests.exceptions import ReadTimeout
+from requests.exceptions import RequestException
+
+try:
+    import httpx
+    import h2  # noqa: F401, required by httpx for HTTP/2
+except ImportError:
+    httpx = None
+
+HTTP2_AVAILABLE = httpx is not None
+
+# Connection-specific headers, forbidden in HTTP/2
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+
+class Http2Body:
+    """
+    File-like view of the body of an httpx response, with the part of the
+    urllib3 HTTPResponse interface used by requests and by read_body().
+    The chunks are read on the event loop of the adapter.
+    """
+
+    def __init__(self, response, run):
+        """
+        :param response: The streamed httpx Response.
+        :param run: Function running a coroutine on the event loop and
+            returning its result.
+        """
+        self._response = response
+        self._run = run
+        self._iterator = None
+        self._buffer = b''
+
+    @staticmethod
+    async def _next_chunk(iterator):
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def stream(self, amt=65536, decode_content=True):
+        """
+        Yields the body in chunks, decoded from its Content-Encoding or not.
+        """
+        if decode_content:
+            iterator = self._response.aiter_bytes(amt)
+        else:
+            iterator = self._response.aiter_raw(amt)
+        while True:
+            try:
+                chunk = self._run(self._next_chunk(iterator))
+            except httpx.HTTPError as err:
+                raise ChunkedEncodingError(err)
+            if chunk is None:
+                break
+            yield chunk
+
+    def read(self, amt=None, decode_content=True):
+        """
+        Reads up to amt bytes of the decoded body, or all of it.
+        """
+        if self._iterator is None:
+            self._iterator = self.stream(decode_content=decode_content)
+        while amt is None or len(self._buffer) < amt:
+            chunk = next(self._iterator, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if amt is None:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        if not self._response.is_closed:
+            self._run(self._response.aclose())
+
+    def release_conn(self):
+        self.close()
+
+
+class Http2Adapter(BaseAdapter):
+    """
+    requests transport adapter backed by an httpx client with HTTP/2.
+    HTTPS connections negotiate HTTP/2 with ALPN and fall back to HTTP/1.1.
+    Cleartext connections use HTTP/1.1, or HTTP/2 with prior knowledge if
+    prior_knowledge is set.
+    """
+
+    def __init__(self, stats, max_connections=10, keep_alive=True, prior_knowledge=False):
+        """
+        :param stats: ConnectionStats object counting connections and requests.
+        :param max_connections: Maximum number of connections open at once.
+        :param keep_alive: If False, no connection is kept open between requests.
+        :param prior_knowledge: If True, speak HTTP/2 to cleartext servers
+            without negotiation, for servers known to support h2c.
+        """
+        super().__init__()
+        self.stats = stats
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections if keep_alive else 0)
+        self.prior_knowledge = prior_knowledge
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+
+    def _run(self, coroutine):
+        # Runs a coroutine on the event loop thread, started on first use
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='http2', daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _client(self, verify):
+        # One client per certificate verification setting, as httpx sets it per client
+        with self._lock:
+            client = self._clients.get(verify)
+            if client is None:
+                client = self._clients[verify] = httpx.AsyncClient(http1=not self.prior_knowledge,
+                                                                   http2=True,
+                                                                   verify=verify,
+                                                                   limits=self.limits,
+                                                                   follow_redirects=False)
+            return client
+
+    async def _trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            self.stats.connection_opened()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        """
+        Sends a requests PreparedRequest over the httpx client.
+
+        :return: A requests Response object.
+        """
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in HOP_BY_HOP_HEADERS]
+        client = self._client(verify)
+        try:
+            http2_request = client.build_request(request.method,
+                                                 request.url,
+                                                 headers=headers,
+                                                 content=request.body,
+                                                 timeout=timeout,
+                                                 extensions={'trace': self._trace})
+            self.stats.request_sent()
+            start = time.perf_counter()
+            http2_response = self._run(client.send(http2_request, stream=True))
+            # Like requests, the time until the headers are received
+            elapsed = time.perf_counter() - start
+        except httpx.ConnectTimeout as err:
+            raise ConnectTimeout(err, request=request)
+        except httpx.ReadTimeout as err:
+            raise ReadTimeout(err, request=request)
+        except (httpx.ConnectError, httpx.RemoteProtocolError) as err:
+            raise ConnectionError(err, request=request)
+        except httpx.HTTPError as err:
+            raise RequestException(err, request=request)
+
+        response = Response()
+        response.status_code = http2_response.status_code
+        response.reason = http2_response.reason_phrase
+        response.headers = CaseInsensitiveDict(http2_response.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=elapsed)
+        response.http_version = http2_response.http_version
+        response.raw = Http2Body(http2_response, self._run)
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        for client in clients.values():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
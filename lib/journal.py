@@ -0,0 +1,239 @@
+"""
+Append-only journal of the crawl state transitions.
+
+Every change to the frontier and the URL sets is appended to a journal
+file in batches while the crawl runs, so a crash loses at most one batch.
+Periodically the journal is compacted: the whole state is stored as a
+snapshot (the usual session files) and the journal starts again empty.
+Resuming loads the last snapshot and replays only the journal tail.
+"""
+import pickle
+import logging
+
+# Events of the sets, named after the set they add a URL to
+SET_EVENTS = ('parsed', 'failed', 'extern', 'errors', 'files')
+# Events after which a URL taken from the frontier is no longer being crawled.
+# A URL is only done once all its outlinks were recorded, so a crash can
+# never lose the outlinks of a URL that will not be crawled again.
+PENDING_END_EVENTS = ('done', 'queued', 'requeued')
+
+
+class Journal:
+    """
+    Buffers state transitions and appends them to the journal file as
+    pickled batches of (event, url, depth) tuples.
+    """
+
+    def __init__(self, file_name, batch_size=1000, compact_every=100000, on_compact=None):
+        """
+        :param file_name: The journal file, appended to if it exists.
+        :param batch_size: Number of events buffered before being written.
+        :param compact_every: Number of events after which the journal is compacted.
+        :param on_compact: Function storing a snapshot of the whole crawl state.
+        """
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.compact_every = compact_every
+        self.on_compact = on_compact
+        self.buffer = []
+        self.events = 0
+        # URLs taken from the frontier that did not reach any set yet
+        self.pending = {}
+        self.file = open(file_name, 'ab')
+
+    def record(self, event, url, depth=None):
+        """
+        Records one state transition.
+
+        :param event: 'queued', 'requeued', 'dequeued', 'done' or one of SET_EVENTS.
+        :param url: The URL concerned.
+        :param depth: Depth of the URL, for the events of the frontier.
+        """
+        if event == 'dequeued':
+            self.pending[url] = depth
+        elif event in PENDING_END_EVENTS:
+            self.pending.pop(url, None)
+        self.buffer.append((event, url, depth))
+        self.events += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        if self.on_compact is not None and self.events >= self.compact_every:
+            self.compact()
+
+    def flush(self):
+        """
+        Appends the buffered events to the journal file.
+        """
+        if self.buffer:
+            pickle.dump(self.buffer, self.file)
+            self.file.flush()
+            self.buffer = []
+
+    def compact(self):
+        """
+        Stores a snapshot of the crawl state and truncates the journal. The
+        URLs being crawled are not part of the snapshot queue, so they are
+        written first in the new journal to be requeued if the crawl dies.
+        """
+        self.on_compact()
+        self.file.close()
+        self.file = open(self.file_name, 'wb')
+        self.buffer = [('inflight', url, depth) for url, depth in self.pending.items()]
+        self.events = 0
+        self.flush()
+
+    def close(self):
+        """
+        Flushes the buffered events and closes the journal file.
+        """
+        self.flush()
+        self.file.close()
+
+
+def read_journal(file_name):
+    """
+    Streams the events of a journal file, stopping at a batch truncated by a crash.
+
+    :param file_name: The journal file.
+    :return: A generator of (event, url, depth) tuples.
+    """
+    try:
+        file = open(file_name, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            except (pickle.UnpicklingError, ValueError, TypeError):
+                logging.warning('Journal %s ends with a truncated batch, ignoring it', file_name)
+                return
+            yield from batch
+
+
+def replay_journal(file_name, urls_queued, urls_seen, url_sets, journal=None):
+    """
+    Applies the events of a journal to the state loaded from the last snapshot.
+
+    :param file_name: The journal file.
+    :param urls_queued: The frontier loaded from the snapshot.
+    :param urls_seen: The seen-set, every replayed URL is added to it.
+    :param url_sets: Dict mapping each of SET_EVENTS to its set.
+    :param journal: The Journal appending to the same file, if the session
+        goes on with it. The URLs put back in the queue are recorded in it,
+        so that a later replay finds them there.
+    :return: The number of events replayed.
+    """
+    pending = {}
+    replayed = 0
+    for event, url, depth in read_journal(file_name):
+        replayed += 1
+        if event == 'dequeued':
+            if len(urls_queued):
+                urls_queued.popleft()
+            pending[url] = depth
+            continue
+        if event == 'inflight':
+            pending[url] = depth
+            continue
+        if event in PENDING_END_EVENTS:
+            pending.pop(url, None)
+        if event == 'done':
+            continue
+        if event == 'queued':
+            urls_queued.append(url, depth)
+        elif event == 'requeued':
+            urls_queued.appendleft(url, depth)
+        else:
+            url_sets[event].add(url)
+        urls_seen.add(url)
+
+    # URLs that were being crawled when the session died go first
+    for url, depth in reversed(list(pending.items())):
+        urls_queued.appendleft(url, depth)
+        if journal is not None:
+            journal.record('requeued', url, depth)
+    return replayed
+
+
+class JournaledSet:
+    """
+    Wraps a crawl set and records every URL added to it.
+    """
+
+    def __init__(self, url_set, journal, event):
+        self.url_set = url_set
+        self.journal = journal
+        self.event = event
+
+    def __len__(self):
+        return len(self.url_set)
+
+    def __contains__(self, url):
+        return url in self.url_set
+
+    def __iter__(self):
+        return iter(self.url_set)
+
+    def add(self, url):
+        """
+        Adds a URL to the set and records it.
+        """
+        self.url_set.add(url)
+        self.journal.record(self.event, url)
+
+    def update(self, urls):
+        """
+        Adds all the URLs of an iterable to the set.
+        """
+        for url in urls:
+            self.add(url)
+
+
+class JournaledQueue:
+    """
+    Wraps the frontier and records every URL entering or leaving it.
+    """
+
+    def __init__(self, url_queue, journal):
+        self.url_queue = url_queue
+        self.journal = journal
+
+    def __len__(self):
+        return len(self.url_queue)
+
+    def append(self, url, depth=0):
+        """
+        Adds a URL at the end of the queue and records it.
+        """
+        self.url_queue.append(url, depth)
+        self.journal.record('queued', url, depth)
+
+    def appendleft(self, url, depth=0):
+        """
+        Adds a URL at the front of the queue and records it.
+        """
+        self.url_queue.appendleft(url, depth)
+        self.journal.record('requeued', url, depth)
+
+    def popleft_entry(self):
+        """
+        Removes the URL at the front of the queue, records it and returns it with its depth.
+        """
+        url, depth = self.url_queue.popleft_entry()
+        self.journal.record('dequeued', url, depth)
+        return url, depth
+
+    def popleft(self):
+        """
+        Removes the URL at the front of the queue, records it and returns it.
+        """
+        return self.popleft_entry()[0]
+
+    def task_done(self, url):
+        """
+        Records that a URL taken from the queue was completely processed.
+        """
+        self.journal.record('done', url)
@@ -1,28 +1,245 @@
 """
 Parses HTML content to find all links, reconstructs full URLs for relative links,
 """
+import re
+import codecs
+from html.parser import HTMLParser
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
+from lib.canonical import parse_url
 
-def find_all_links(html_content, base_schema, base_url):
+# Only the start of the document is sniffed for a declared charset
+CHARSET_SNIFF_SIZE = 1024
+CHARSET_REGEX = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([-\w.:]+)', re.IGNORECASE)
+BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+# Attributes holding links for each tag, and the kind of link they hold
+LINK_ATTRIBUTES = {
+    'a': (('href', 'anchor'),),
+    'area': (('href', 'anchor'),),
+    'link': (('href', 'link'),),
+    'script': (('src', 'script'),),
+    'img': (('src', 'image'), ('srcset', 'image')),
+    'input': (('src', 'image'), ('formaction', 'form')),
+    'source': (('src', 'media'), ('srcset', 'media')),
+    'video': (('src', 'media'), ('poster', 'image')),
+    'audio': (('src', 'media'),),
+    'track': (('src', 'media'),),
+    'embed': (('src', 'media'),),
+    'object': (('data', 'media'),),
+    'iframe': (('src', 'frame'),),
+    'frame': (('src', 'frame'),),
+    'form': (('action', 'form'),),
+    'button': (('formaction', 'form'),),
+}
+SRCSET_ATTRIBUTES = {'srcset'}
+# Tags whose text content is scanned for links
+TEXT_TAGS = {'style', 'script'}
+CSS_URL_REGEX = re.compile(r'''url\(\s*(["']?)(.*?)\1\s*\)|@import\s+(["'])(.*?)\3''', re.IGNORECASE)
+# window.open() or a bare open(), not the open() of another object such as
+# xhr.open('GET', url), whose first argument is never a link
+SCRIPT_REDIRECT_REGEX = re.compile(r'''(?:location(?:\.href)?\s*=\s*|location\.(?:assign|replace)\(\s*|'''
+                                   r'''(?:\bwindow\.|(?<![\w.$]))open\(\s*)(["'])'''
+                                   r'''(?!(?i:get|head|post|put|delete|options|patch|trace|connect)\1)(.*?)\1''')
+META_REFRESH_REGEX = re.compile(r'''url\s*=\s*["']?([^"'\s]+)''', re.IGNORECASE)
+
+
+def absolute_url(href, base_full_url):
     """
-    Parses HTML content to find all links, reconstructs full URLs for relative links,
-    and returns a set of these URLs.
+    Reconstructs the full URL of a link found in a page.
 
-    :param html_content: The HTML content as a string.
-    :param base_schema: The base schema (e.g., 'http', 'https') for forming URLs.
-    :param base_url: The base URL to resolve relative URLs against.
-    :return: A set of full-path URLs.
+    :param href: The link as found in the HTML content.
+    :param base_full_url: The scheme and network location to resolve relative URLs against.
+    :return: The full URL.
     """
+    # Check if the href is a relative URL
+    if not href.startswith(('http://', 'https://', 'ftp://')):
+        href = urljoin(base_full_url, href)  # Convert relative URL to absolute
+    return href
+
+
+def sniff_encoding(head):
+    """
+    Guesses the encoding of an HTML document from its first bytes, looking for
+    a byte order mark or a declared charset. Defaults to UTF-8.
+
+    :param head: The first bytes of the document.
+    :return: The name of the encoding.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    match = CHARSET_REGEX.search(head[:CHARSET_SNIFF_SIZE])
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+def links_in_tag(tag, attrs):
+    """
+    Finds the links held by the attributes of one tag.
+
+    :param tag: The lower case tag name.
+    :param attrs: A dict of the tag attributes.
+    :return: A list of (link, kind) tuples, in document order.
+    """
+    links = []
+    for name, kind in LINK_ATTRIBUTES.get(tag, ()):
+        value = attrs.get(name)
+        if value is None:
+            continue
+        if name in SRCSET_ATTRIBUTES:
+            # Candidates are separated by commas: "url [descriptor], ..."
+            links.extend((candidate.split()[0], kind) for candidate in value.split(',') if candidate.strip())
+        else:
+            links.append((value, kind))
+
+    if tag == 'meta' and attrs.get('http-equiv', '').lower() == 'refresh':
+        match = META_REFRESH_REGEX.search(attrs.get('content', ''))
+        if match:
+            links.append((match.group(1), 'redirect'))
+
+    style = attrs.get('style')
+    if style:
+        links.extend(links_in_text('style', style))
+    return links
+
+
+def links_in_text(tag, text):
+    """
+    Finds the links in the text content of a style or script tag, or in a
+    style attribute: CSS url() and @import, and script redirections.
+
+    :param tag: 'style' or 'script'.
+    :param text: The text to scan.
+    :return: A list of (link, kind) tuples, in document order.
+    """
+    if tag == 'script':
+        return [(match.group(2), 'redirect') for match in SCRIPT_REDIRECT_REGEX.finditer(text)]
+    return [(match.group(2) if match.group(2) is not None else match.group(4), 'css')
+            for match in CSS_URL_REGEX.finditer(text)]
+
+
+def add_links(found, links, base_full_url):
+    """
+    Adds links to the found links, keeping the kind of the first occurrence.
+
+    :param found: Dict mapping the ParsedUrl records of the full URLs to their kind.
+    :param links: Iterable of (link, kind) tuples.
+    :param base_full_url: The scheme and network location to resolve relative URLs against.
+    """
+    for href, kind in links:
+        found.setdefault(parse_url(absolute_url(href.strip(), base_full_url)), kind)
+
+
+class StreamingLinkExtractor(HTMLParser):
+    """
+    Tokenizes HTML as it is fed and collects the links as the tags are
+    scanned, without building a document tree. Chunks can be fed as they
+    arrive from the network, either as bytes or str.
+    """
+
+    def __init__(self, base_full_url):
+        """
+        :param base_full_url: The scheme and network location to resolve relative URLs against.
+        """
+        super().__init__(convert_charrefs=True)
+        self.base_full_url = base_full_url
+        self.urls = {}
+        self._decoder = None
+        self._text_tag = None
+        self._text = []
+
+    def feed(self, data):
+        """
+        Feeds a chunk of the document to the tokenizer.
+
+        :param data: A chunk of the HTML content, as bytes or str.
+        """
+        if isinstance(data, bytes):
+            if self._decoder is None:
+                self._decoder = codecs.getincrementaldecoder(sniff_encoding(data))(errors='replace')
+            data = self._decoder.decode(data)
+        super().feed(data)
+
+    def close(self):
+        """
+        Flushes the tokenizer and returns the links found.
+
+        :return: A dict mapping ParsedUrl records of the full-path URLs to the kind of link.
+        """
+        if self._decoder is not None:
+            super().feed(self._decoder.decode(b'', final=True))
+        super().close()
+        self._flush_text()
+        return self.urls
+
+    def _flush_text(self):
+        if self._text_tag is not None:
+            add_links(self.urls, links_in_text(self._text_tag, ''.join(self._text)), self.base_full_url)
+        self._text_tag = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        # Like BeautifulSoup, the last duplicated attribute wins
+        attrs = {name: value or '' for name, value in attrs}
+        add_links(self.urls, links_in_tag(tag, attrs), self.base_full_url)
+        if tag in TEXT_TAGS:
+            self._flush_text()
+            self._text_tag = tag
+
+    def handle_endtag(self, tag):
+        if tag == self._text_tag:
+            self._flush_text()
+
+    def handle_data(self, data):
+        if self._text_tag is not None:
+            self._text.append(data)
+
+
+def _find_all_links_bs4(html_content, base_full_url):
     soup = BeautifulSoup(html_content, 'html.parser')
-    urls = set()
-    base_full_url = f"{base_schema}://{base_url}"
+    urls = {}
 
-    for tag in soup.find_all('a', href=True):  # Find all <a> tags with an href attribute
-        href = tag['href']
-        # Check if the href is a relative URL
-        if not href.startswith(('http://', 'https://', 'ftp://')):
-            href = urljoin(base_full_url, href)  # Convert relative URL to absolute
-        urls.add(href)
+    # One walk over all the tags, in document order
+    for tag in soup.find_all(True):
+        attrs = {name: ' '.join(value) if isinstance(value, list) else value
+                 for name, value in tag.attrs.items()}
+        add_links(urls, links_in_tag(tag.name, attrs), base_full_url)
+        if tag.name in TEXT_TAGS:
+            add_links(urls, links_in_text(tag.name, tag.get_text()), base_full_url)
 
     return urls
+
+
+def _find_all_links_stream(html_content, base_full_url):
+    extractor = StreamingLinkExtractor(base_full_url)
+    extractor.feed(html_content)
+    return extractor.close()
+
+
+PARSERS = {
+    'bs4': _find_all_links_bs4,
+    'stream': _find_all_links_stream,
+}
+
+
+def find_all_links(html_content, base_schema, base_url, parser='bs4'):
+    """
+    Parses HTML content to find all links (anchors, assets, frames, forms,
+    redirections and CSS urls) in a single pass, reconstructs full URLs for
+    relative links, and returns these URLs tagged with their kind of link.
+
+    :param html_content: The HTML content as a string.
+    :param base_schema: The base schema (e.g., 'http', 'https') for forming URLs.
+    :param base_url: The base URL to resolve relative URLs against.
+    :param parser: The extractor backend, one of PARSERS ('bs4' or 'stream').
+    :return: A dict mapping ParsedUrl records of the canonical full-path URLs to
+        the kind of link ('anchor', 'link', 'script', 'image', 'media', 'frame',
+        'form', 'redirect' or 'css').
+    """
+    base_full_url = f"{base_schema}://{base_url}"
+    return PARSERS[parser](html_content, base_full_url)
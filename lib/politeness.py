@@ -0,0 +1,250 @@
+"""
+Per-host politeness scheduler.
+
+Each host gets a token bucket refilled at its current rate. The rate
+starts at the allowed ceiling, is halved when the host answers 429 or 503,
+and ramps back up towards the ceiling while its latency stays healthy.
+A Retry-After header blocks the host for the time it asks for. Without a
+rate limit, a throttling response without Retry-After blocks the host for
+a delay doubling at each new throttling response.
+"""
+import time
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+
+# Responses telling the crawler to slow down
+THROTTLE_STATUSES = (429, 503)
+# Rate multiplier applied on a throttling response
+BACKOFF_FACTOR = 0.5
+# Fraction of the ceiling added to the rate on each healthy response
+RAMP_STEP = 0.1
+# Seconds after a backoff during which other throttling responses, answers
+# to requests sent before the backoff, do not back off again
+BACKOFF_COOLDOWN = 1.0
+# Lowest rate a host is backed off to, as a fraction of the ceiling
+MIN_RATE_FACTOR = 0.01
+# Longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 3600
+# First delay a host is blocked for without a rate limit nor Retry-After, in seconds
+DEFAULT_BACKOFF = 1.0
+# Longest delay of the default backoff, in seconds
+MAX_BACKOFF = 60.0
+# Times a throttled URL is put back in the frontier before failing it
+MAX_THROTTLED_RETRIES = 3
+
+
+def parse_retry_after(value, now=None):
+    """
+    Converts a Retry-After header, in seconds or as an HTTP date, to a delay.
+
+    :param value: The header value.
+    :param now: Current time as a Unix timestamp, defaults to time.time().
+    :return: The delay in seconds, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        delay = int(value)
+    else:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - (now if now is not None else time.time())
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+    return min(max(delay, 0), MAX_RETRY_AFTER)
+
+
+class HostBucket:
+    """
+    Token bucket of one host. Tokens may go negative: each request takes a
+    token right away and waits until the bucket would have refilled it, so
+    concurrent requests to the host get distinct, evenly spaced slots.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: Initial and maximum requests per second.
+        :param burst: Maximum number of tokens saved up while the host is idle.
+        """
+        self.ceiling = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        # Time of the last refill, in the future while the host is blocked
+        self.last = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.last_backoff = None
+        self.first_request = None
+        self.last_request = None
+
+    def reserve(self, now):
+        """
+        Takes one token and returns how long to wait before using it.
+        """
+        if now > self.last:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+        self.tokens -= 1
+        wait = self.last - now
+        if self.tokens < 0:
+            wait += -self.tokens / self.rate
+        return wait
+
+    def block(self, now, delay):
+        """
+        Stops handing out tokens until delay seconds from now.
+        """
+        self.tokens = min(self.tokens, 0)
+        self.last = max(self.last, now + delay)
+
+    def backoff(self, now):
+        """
+        Halves the rate, down to a small fraction of the ceiling, at most
+        once per cooldown.
+
+        :return: True if the rate was lowered.
+        """
+        if self.last_backoff is not None and now - self.last_backoff < BACKOFF_COOLDOWN:
+            return False
+        self.last_backoff = now
+        self.rate = max(self.ceiling * MIN_RATE_FACTOR, self.rate * BACKOFF_FACTOR)
+        return True
+
+    def ramp_up(self):
+        """
+        Raises the rate by a step, up to the ceiling.
+        """
+        self.rate = min(self.ceiling, self.rate + self.ceiling * RAMP_STEP)
+
+    @property
+    def throughput(self):
+        """
+        Requests per second achieved between the first and the last request.
+        """
+        if self.requests < 2 or self.last_request <= self.first_request:
+            return 0.0
+        return (self.requests - 1) / (self.last_request - self.first_request)
+
+
+class PolitenessScheduler:
+    """
+    Hands out request slots per host from one token bucket per host, and
+    adapts the rate of each host to its responses. All the methods are
+    called from the event loop thread of the crawl engine.
+    """
+
+    def __init__(self, rate=None, burst=1, latency_target=1.0):
+        """
+        :param rate: Maximum requests per second per host, None for no limit.
+            Without a limit, the hosts are only blocked after a throttling
+            response, for its Retry-After or a doubling default delay.
+        :param burst: Requests a host may get at once after being idle.
+        :param latency_target: Response time in seconds under which a host
+            is considered healthy and its rate ramps up.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.latency_target = latency_target
+        self.buckets = {}
+        self.blocked_until = {}
+        # Consecutive default backoffs of each host, without a rate limit
+        self.backoffs = {}
+
+    def _bucket(self, host):
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = HostBucket(self.rate, self.burst)
+        return bucket
+
+    async def acquire(self, host):
+        """
+        Waits until a request to the host is allowed.
+
+        :param host: Network location of the URL about to be fetched.
+        """
+        now = time.monotonic()
+        if self.rate is None:
+            wait = self.blocked_until.get(host, now) - now
+        else:
+            bucket = self._bucket(host)
+            wait = bucket.reserve(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if self.rate is not None:
+            now = time.monotonic()
+            if bucket.first_request is None:
+                bucket.first_request = now
+            bucket.last_request = now
+            bucket.requests += 1
+
+    def _default_backoff(self, host, now):
+        # Answers to the requests sent before the host was blocked do not
+        # double the delay again
+        if self.blocked_until.get(host, now) > now:
+            return
+        backoffs = self.backoffs.get(host, 0)
+        self.backoffs[host] = backoffs + 1
+        delay = min(DEFAULT_BACKOFF * 2 ** backoffs, MAX_BACKOFF)
+        self.blocked_until[host] = now + delay
+        logging.debug('POLITENESS - %s blocked for %.1fs without Retry-After', host, delay)
+
+    def record(self, host, status_code, retry_after=None, elapsed=None):
+        """
+        Adapts the rate of a host to one of its responses.
+
+        :param host: Network location of the URL fetched.
+        :param status_code: HTTP status of the response, None if there was none.
+        :param retry_after: Retry-After header of the response, if any.
+        :param elapsed: Response time in seconds.
+        :return: True if the host asked the crawler to slow down.
+        """
+        now = time.monotonic()
+        throttled = status_code in THROTTLE_STATUSES
+        delay = parse_retry_after(retry_after) if throttled else None
+        if delay:
+            if self.rate is None:
+                self.blocked_until[host] = max(self.blocked_until.get(host, now), now + delay)
+            else:
+                self._bucket(host).block(now, delay)
+            logging.debug('POLITENESS - %s blocked for %.1fs by Retry-After', host, delay)
+
+        if self.rate is None:
+            if throttled and not delay:
+                self._default_backoff(host, now)
+            elif not throttled and status_code is not None:
+                self.backoffs.pop(host, None)
+            return throttled
+
+        bucket = self._bucket(host)
+        if throttled:
+            bucket.throttled += 1
+            if bucket.backoff(now):
+                logging.debug('POLITENESS - %s answered %i, backing off to %.2f req/s',
+                              host, status_code, bucket.rate)
+        elif status_code is not None and elapsed is not None and elapsed <= self.latency_target:
+            bucket.ramp_up()
+        return throttled
+
+    def state(self):
+        """
+        Returns the state of the scheduler, to check the throughput of each
+        host against its ceiling.
+
+        :return: Dict mapping each host to a dict with its 'rate', 'ceiling',
+            'tokens', 'requests', 'throttled', 'throughput' and 'blocked' (seconds left).
+        """
+        now = time.monotonic()
+        return {
+            host: {
+                'rate': bucket.rate,
+                'ceiling': bucket.ceiling,
+                'tokens': bucket.tokens,
+                'requests': bucket.requests,
+                'throttled': bucket.throttled,
+                'throughput': bucket.throughput,
+                'blocked': max(0.0, bucket.last - now),
+            }
+            for host, bucket in self.buckets.items()
+        }
@@ -0,0 +1,119 @@
+"""
+Validators of the pages of previous crawls, for conditional recrawls.
+
+For each HTML page the store keeps its ETag, Last-Modified, a hash of its
+content and its outlinks. A recrawl sends the validators back, and a page
+answering 304 Not Modified, or with the same content hash, is not parsed
+again: its stored outlinks are used instead.
+"""
+import time
+import zlib
+import pickle
+import hashlib
+import sqlite3
+from lib.canonical import parse_url
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash BLOB,
+    outlinks BLOB,
+    updated REAL
+) WITHOUT ROWID;
+"""
+
+
+def content_hasher():
+    """
+    Returns a hash object to feed with the chunks of a page as they are read.
+    Its digest() is the content_hash() of the page.
+    """
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_hash(content):
+    """
+    Returns the hash identifying the content of a page.
+
+    :param content: The body of the page, in bytes.
+    :return: A 16 bytes digest.
+    """
+    hasher = content_hasher()
+    hasher.update(content)
+    return hasher.digest()
+
+
+class RecrawlStore:
+    """
+    Pages of the previous crawls of a site, stored in a SQLite database that
+    is kept from one crawl to the next. Writes are grouped in transactions
+    committed every batch_size pages.
+    """
+
+    def __init__(self, file_name, batch_size=1000):
+        """
+        :param file_name: The database file, created if it does not exist.
+        :param batch_size: Number of pages committed together.
+        """
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.changes = 0
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def get(self, url):
+        """
+        Returns what is known of a page from the previous crawls.
+
+        :param url: The URL of the page.
+        :return: A dict with the 'etag', 'last_modified', 'content_hash' and
+            'outlinks' keys, or None if the page was never crawled. The
+            outlinks map ParsedUrl records to their kind, like the found links.
+        """
+        row = self.connection.execute(
+            'SELECT etag, last_modified, content_hash, outlinks FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        outlinks = pickle.loads(zlib.decompress(row[3])) if row[3] else {}
+        return {
+            'etag': row[0],
+            'last_modified': row[1],
+            'content_hash': row[2],
+            'outlinks': {parse_url(url): kind for url, kind in outlinks.items()},
+        }
+
+    def store(self, url, etag, last_modified, page_hash, outlinks):
+        """
+        Stores the validators and the outlinks of a crawled page.
+
+        :param url: The URL of the page.
+        :param etag: ETag header of the response, if any.
+        :param last_modified: Last-Modified header of the response, if any.
+        :param page_hash: Hash of the content, see content_hash().
+        :param outlinks: Dict of the links found in the page, ParsedUrl record to kind.
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, outlinks, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (url, etag, last_modified, page_hash, zlib.compress(pickle.dumps({link.url: kind for link, kind in outlinks.items()})), time.time()))
+        self.changes += 1
+        if self.changes >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """
+        Commits the pending changes.
+        """
+        self.connection.commit()
+        self.changes = 0
+
+    def close(self):
+        """
+        Commits the pending changes and closes the database.
+        """
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,155 @@
+"""
+Log of the HTTP requests of the crawl, in Common Log Format or in the
+combined format that adds the referer and the user agent.
+
+Every response received by the crawl session is logged: HEAD and GET
+requests, robots.txt and sitemaps. The fetch threads only put a tuple in a
+bounded queue, and a background thread formats the lines and writes them in
+batches, so a slow disk never stalls the fetches. When the queue is full the
+line is dropped and counted rather than blocking the fetch.
+
+The writer flushes the file after each batch, and the log is closed after
+the crawl, CTRL-C included, so the lines of the requests done before an
+interruption are kept.
+"""
+import queue
+import socket
+import logging
+import threading
+import time
+
+FORMATS = ('common', 'combined')
+# HTTP version of the urllib3 responses
+PROTOCOLS = {9: 'HTTP/0.9', 10: 'HTTP/1.0', 11: 'HTTP/1.1', 20: 'HTTP/2'}
+# Statuses that never have a body
+BODYLESS_STATUSES = (204, 304)
+# Lines written together by the writer thread
+BATCH_SIZE = 1000
+
+
+def _quote(value):
+    if not value:
+        return '-'
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def response_size(response):
+    """
+    Returns the size of the body of a response as sent by the server, for
+    the bytes field of the log: its Content-Length, or the length of the
+    body when it was already read.
+
+    :return: The size in bytes, or None when unknown or without a body.
+    """
+    if response.request.method == 'HEAD' or response.status_code in BODYLESS_STATUSES:
+        return None
+    length = response.headers.get('Content-Length')
+    if length is not None and length.isdigit():
+        return int(length)
+    if response._content_consumed and response._content:
+        return len(response._content)
+    return None
+
+
+def response_protocol(response):
+    """
+    Returns the HTTP version of a response, e.g. 'HTTP/1.1'.
+    """
+    version = getattr(response, 'http_version', None)
+    if version:
+        return version
+    return PROTOCOLS.get(getattr(response.raw, 'version', None), 'HTTP/1.1')
+
+
+class RequestLog:
+    """
+    Writes one line per HTTP request to a log file, from a background thread.
+    Use log_response() as a response hook of the requests session.
+    """
+
+    def __init__(self, file_name, log_format='common', queue_size=10000, username=None):
+        """
+        :param file_name: The log file, appended to if it exists.
+        :param log_format: 'common' or 'combined'.
+        :param queue_size: Maximum number of lines waiting to be written.
+            Further lines are dropped until the writer catches up.
+        :param username: User name of the basic authentication, logged as
+            the authenticated user.
+        """
+        self.log_format = log_format
+        self.hostname = socket.gethostname()
+        self.username = username or '-'
+        self.logged = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = open(file_name, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._write_lines, name='request-log', daemon=True)
+        self._thread.start()
+
+    def log_response(self, response, *args, **kwargs):
+        """
+        Response hook of a requests session: queues the line of the request.
+
+        :param response: A requests Response object.
+        """
+        if self._closed:
+            return
+        request = response.request
+        # The timestamp of a log line is the time the request was sent
+        sent = time.time() - response.elapsed.total_seconds()
+        entry = (sent, request.method, request.url, response_protocol(response), response.status_code,
+                 response_size(response), request.headers.get('Referer'), request.headers.get('User-Agent'))
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def format_line(self, entry):
+        """
+        Formats the log line of a queued request.
+
+        :param entry: A tuple (timestamp, method, url, protocol, status, size, referer, user agent).
+        :return: The line, without its end of line.
+        """
+        sent, method, url, protocol, status, size, referer, user_agent = entry
+        timestamp = time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(sent))
+        line = (f'{self.hostname} - {self.username} [{timestamp}] "{method} {_quote(url)} {protocol}" '
+                f'{status} {"-" if size is None else size}')
+        if self.log_format == 'combined':
+            line += f' "{_quote(referer)}" "{_quote(user_agent)}"'
+        return line
+
+    def _write_lines(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None is queued by close(), after the last lines
+            entries = [entry for entry in batch if entry is not None]
+            stop = len(entries) < len(batch)
+            try:
+                self._file.write(''.join(self.format_line(entry) + '\n' for entry in entries))
+                self._file.flush()
+                self.logged += len(entries)
+            except (OSError, ValueError) as err:
+                logging.error('Cannot write the request log: %s', err)
+            if stop:
+                return
+
+    def close(self):
+        """
+        Writes the queued lines and closes the log file. Requests logged
+        afterwards, by fetches still running, are ignored.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
@@ -0,0 +1,194 @@
+"""
+On-disk cache of HTTP responses, for crawling the same site many times.
+
+Responses are stored in a SQLite database: the status and headers of each
+request, and the compressed bodies addressed by their hash, so identical
+bodies are stored once. Entries expire after a TTL, and the least recently
+used ones are evicted when the bodies exceed the size cap.
+"""
+import time
+import zlib
+import pickle
+import hashlib
+import sqlite3
+import threading
+from datetime import timedelta
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Statuses stored in the cache, the other responses are always fetched
+CACHEABLE_STATUSES = (200, 203, 301, 302, 307, 308, 404, 410)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    reason TEXT,
+    headers BLOB NOT NULL,
+    body_hash TEXT,
+    stored REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE INDEX IF NOT EXISTS entries_body_hash ON entries (body_hash);
+CREATE TABLE IF NOT EXISTS bodies (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class ResponseCache:
+    """
+    Thread-safe response cache, shared by the fetch threads of the crawl.
+    """
+
+    def __init__(self, file_name, ttl=86400, max_size=1024 ** 3, batch_size=100):
+        """
+        :param file_name: The database file, created if it does not exist.
+        :param ttl: Seconds after which a stored response is fetched again.
+        :param max_size: Maximum size in bytes of the compressed bodies.
+        :param batch_size: Number of changes committed together.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.changes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+
+    @staticmethod
+    def key(method, url):
+        """
+        Returns the cache key of a request.
+        """
+        return f'{method} {url}'
+
+    def _changed(self):
+        self.changes += 1
+        if self.changes >= self.batch_size:
+            self.connection.commit()
+            self.changes = 0
+
+    def get(self, method, url):
+        """
+        Returns a stored response that did not expire yet.
+
+        :param method: HTTP method of the request.
+        :param url: URL of the request.
+        :return: A tuple (status, reason, headers, body), or None on a miss.
+            The body is None for HEAD requests.
+        """
+        key = self.key(method, url)
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT status, reason, headers, body_hash, stored FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[4] > self.ttl:
+                self.misses += 1
+                return None
+            body = None
+            if row[3] is not None:
+                data = self.connection.execute('SELECT data FROM bodies WHERE hash = ?', (row[3],)).fetchone()
+                if data is None:
+                    self.misses += 1
+                    return None
+                body = zlib.decompress(data[0])
+            self.connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self._changed()
+            self.hits += 1
+        return row[0], row[1], pickle.loads(row[2]), body
+
+    def put(self, method, url, status, reason, headers, body):
+        """
+        Stores a response, replacing the previous one of the same request.
+
+        :param method: HTTP method of the request.
+        :param url: URL of the request.
+        :param status: HTTP status of the response.
+        :param reason: Reason phrase of the response.
+        :param headers: Dict of the response headers.
+        :param body: Body of the response in bytes, None for HEAD requests.
+        """
+        key = self.key(method, url)
+        now = time.time()
+        body_hash = hashlib.sha256(body).hexdigest() if body is not None else None
+        with self._lock:
+            if body_hash is not None:
+                exists = self.connection.execute('SELECT 1 FROM bodies WHERE hash = ?', (body_hash,)).fetchone()
+                if exists is None:
+                    data = zlib.compress(body)
+                    self.connection.execute('INSERT INTO bodies (hash, size, data) VALUES (?, ?, ?)',
+                                            (body_hash, len(data), data))
+                    self.size += len(data)
+            previous = self.connection.execute('SELECT body_hash FROM entries WHERE key = ?', (key,)).fetchone()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO entries (key, status, reason, headers, body_hash, stored, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, status, reason, pickle.dumps(dict(headers)), body_hash, now, now))
+            if previous is not None and previous[0] != body_hash:
+                self._drop_body(previous[0])
+            self._changed()
+            if self.size > self.max_size:
+                self._evict()
+
+    def _drop_body(self, body_hash):
+        # Bodies are shared by all the entries with the same content
+        if body_hash is None:
+            return
+        if self.connection.execute('SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1', (body_hash,)).fetchone():
+            return
+        row = self.connection.execute('SELECT size FROM bodies WHERE hash = ?', (body_hash,)).fetchone()
+        if row is not None:
+            self.connection.execute('DELETE FROM bodies WHERE hash = ?', (body_hash,))
+            self.size -= row[0]
+
+    def _evict(self):
+        # Least recently used entries first, until the bodies fit again
+        while self.size > self.max_size:
+            rows = self.connection.execute(
+                'SELECT key, body_hash FROM entries ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, body_hash in rows:
+                self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._drop_body(body_hash)
+                if self.size <= self.max_size:
+                    break
+
+    def close(self):
+        """
+        Commits the pending changes and closes the database.
+        """
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def cached_response(request, status, reason, headers, body):
+    """
+    Builds a requests Response from a stored response.
+
+    :param request: The PreparedRequest being answered.
+    :return: A Response object with a `from_cache` attribute set to True.
+    """
+    response = Response()
+    response.status_code = status
+    response.reason = reason
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.elapsed = timedelta(0)
+    response._content = body if body is not None else b''
+    response._content_consumed = True
+    response.from_cache = True
+    return response
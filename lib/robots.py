@@ -0,0 +1,272 @@
+"""
+robots.txt rules and sitemaps of the crawled hosts.
+
+robots.txt is fetched once per host and its rules for the crawler are
+compiled into a single regular expression, so checking a URL at enqueue
+time is one match. Sitemaps, including sitemap indexes and gzipped
+sitemaps, are parsed as a stream to seed the frontier.
+"""
+import re
+import zlib
+import logging
+import xml.etree.ElementTree as ElementTree
+from urllib.parse import urlparse
+import requests
+from requests.exceptions import ConnectionError
+
+GZIP_MAGIC = b'\x1f\x8b'
+# Sitemaps read from one host, indexes included, to stop runaway indexes
+MAX_SITEMAPS = 1000
+
+
+def _rule_regex(path):
+    # '*' matches any sequence of characters and a final '$' anchors the rule
+    anchored = path.endswith('$')
+    if anchored:
+        path = path[:-1]
+    regex = '.*'.join(re.escape(part) for part in path.split('*'))
+    return regex + '$' if anchored else regex
+
+
+class RobotsRules:
+    """
+    Allow and Disallow rules of the robots.txt group that applies to the
+    crawler. The most specific (longest) matching rule decides, and Allow
+    wins over Disallow on rules of the same length.
+    """
+
+    def __init__(self, rules=(), sitemaps=(), crawl_delay=None, allow_all=True):
+        """
+        :param rules: Iterable of (allow, path) tuples.
+        :param sitemaps: Sitemap URLs listed in the robots.txt.
+        :param crawl_delay: Crawl-delay of the group, in seconds.
+        :param allow_all: Decision for the URLs no rule matches.
+        """
+        self.rules = [(allow, path) for allow, path in rules if path]
+        self.sitemaps = list(sitemaps)
+        self.crawl_delay = crawl_delay
+        self.allow_all = allow_all
+
+        # Alternatives are tried in order, so sorting them by precedence
+        # makes the first match the deciding rule.
+        ordered = sorted(self.rules, key=lambda rule: (-len(rule[1]), not rule[0]))
+        alternatives = [f'(?P<{"a" if allow else "d"}{index}>{_rule_regex(path)})'
+                        for index, (allow, path) in enumerate(ordered)]
+        self.matcher = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def allowed(self, url):
+        """
+        Checks if the crawler may fetch a URL.
+
+        :param url: Absolute URL, or path with its query.
+        :return: True if the URL is allowed.
+        """
+        if self.matcher is None:
+            return self.allow_all
+        parsed = urlparse(url)
+        path = (parsed.path or '/') + ('?' + parsed.query if parsed.query else '')
+        match = self.matcher.match(path)
+        if match is None:
+            return self.allow_all
+        return match.lastgroup[0] == 'a'
+
+
+def product_token(user_agent):
+    """
+    Returns the product token of a User-Agent header, the name robots.txt
+    groups use, e.g. 'python-requests' for 'python-requests/2.31.0'.
+    """
+    token = user_agent.strip().split(None, 1)[0] if user_agent.strip() else '*'
+    return token.split('/', 1)[0]
+
+
+def parse_robots(text, user_agent='*'):
+    """
+    Parses a robots.txt file.
+
+    :param text: Content of the robots.txt.
+    :param user_agent: Product token of the crawler. The groups naming
+        exactly this token apply, or else the '*' groups.
+    :return: A RobotsRules object.
+    """
+    user_agent = user_agent.lower()
+    groups = {}
+    sitemaps = []
+    agents = []
+    in_rules = False
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        field, value = line.split(':', 1)
+        field = field.strip().lower()
+        value = value.strip()
+        if field == 'sitemap':
+            # Sitemap lines do not belong to any group
+            if value:
+                sitemaps.append(value)
+        elif field == 'user-agent':
+            if in_rules:
+                # A user-agent line after rules starts a new group
+                agents = []
+                in_rules = False
+            agents.append(value.lower())
+            for agent in agents:
+                groups.setdefault(agent, {'rules': [], 'crawl_delay': None})
+        elif field in ('allow', 'disallow', 'crawl-delay'):
+            in_rules = True
+            for agent in agents:
+                group = groups[agent]
+                if field == 'crawl-delay':
+                    try:
+                        group['crawl_delay'] = float(value)
+                    except ValueError:
+                        pass
+                else:
+                    group['rules'].append((field == 'allow', value))
+
+    # The product token is matched as a whole, case-insensitively (RFC 9309)
+    group = groups.get(user_agent) if user_agent != '*' else None
+    if group is None:
+        group = groups.get('*', {'rules': [], 'crawl_delay': None})
+    return RobotsRules(group['rules'], sitemaps, group['crawl_delay'])
+
+
+class RobotsCache:
+    """
+    robots.txt rules of every host of the crawl, fetched once per host.
+    """
+
+    def __init__(self, session, user_agent='*'):
+        """
+        :param session: The requests Session of the crawl.
+        :param user_agent: Product token of the crawler in the robots.txt groups.
+        """
+        self.session = session
+        self.user_agent = user_agent
+        self.rules = {}
+
+    @staticmethod
+    def origin(url):
+        """
+        Returns the scheme and network location of a URL, the key of its rules.
+        """
+        parsed = urlparse(url)
+        return f'{parsed.scheme}://{parsed.netloc}'
+
+    def get(self, origin, default=None):
+        """
+        Returns the rules of an origin, or default if they were not loaded yet.
+        """
+        return self.rules.get(origin, default)
+
+    def load(self, origin):
+        """
+        Fetches and parses the robots.txt of an origin. A missing robots.txt
+        (4xx) allows everything; a server error or an unreachable host
+        disallows everything, as the rules cannot be known.
+
+        :param origin: Scheme and network location, e.g. https://example.org.
+        :return: A RobotsRules object, also stored in the cache.
+        """
+        try:
+            response = self.session.get(f'{origin}/robots.txt', verify=False, timeout=5)
+            if response.ok:
+                rules = parse_robots(response.text, self.user_agent)
+            elif 400 <= response.status_code < 500:
+                rules = RobotsRules()
+            else:
+                rules = RobotsRules(allow_all=False)
+        except (ConnectionError, requests.RequestException) as err:
+            logging.warning('Cannot fetch %s/robots.txt (%s), not crawling that host', origin, err)
+            rules = RobotsRules(allow_all=False)
+        logging.info('ROBOTS - %s - %i rules, %i sitemaps', origin, len(rules.rules), len(rules.sitemaps))
+        self.rules[origin] = rules
+        return rules
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _sitemap_entries(parser, state):
+    for event, element in parser.read_events():
+        if event == 'start':
+            if state.get('root') is None:
+                state['root'] = element
+            continue
+        name = _local_name(element.tag)
+        if name in ('url', 'sitemap'):
+            for child in element:
+                if _local_name(child.tag) == 'loc' and child.text and child.text.strip():
+                    yield name, child.text.strip()
+                    break
+            # Drop the entries already read
+            element.clear()
+            state['root'].clear()
+
+
+def iter_sitemap(chunks):
+    """
+    Streams the entries of a sitemap or sitemap index. Elements are cleared
+    once read, so memory does not grow with the size of the sitemap.
+
+    :param chunks: Iterable of bytes of the XML, gzipped or not.
+    :return: A generator of ('url', loc) or ('sitemap', loc) tuples.
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    state = {}
+    decompressor = None
+    first = True
+    for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        parser.feed(chunk)
+        yield from _sitemap_entries(parser, state)
+    parser.close()
+    yield from _sitemap_entries(parser, state)
+
+
+def sitemap_urls(session, sitemaps, max_sitemaps=MAX_SITEMAPS):
+    """
+    Fetches sitemaps and yields the page URLs they list, following the
+    sitemap indexes.
+
+    :param session: The requests Session of the crawl.
+    :param sitemaps: URLs of the sitemaps to start from.
+    :param max_sitemaps: Maximum number of sitemaps fetched.
+    :return: A generator of page URLs.
+    """
+    pending = list(sitemaps)
+    fetched = set()
+    while pending and len(fetched) < max_sitemaps:
+        sitemap = pending.pop(0)
+        if sitemap in fetched:
+            continue
+        fetched.add(sitemap)
+        try:
+            response = session.get(sitemap, verify=False, timeout=5, stream=True)
+        except (ConnectionError, requests.RequestException) as err:
+            logging.warning('Cannot fetch sitemap %s (%s)', sitemap, err)
+            continue
+        try:
+            if not response.ok:
+                logging.warning('Cannot fetch sitemap %s (%s)', sitemap, response.status_code)
+                continue
+            # iter_content undoes the Content-Encoding, a .gz sitemap is still gzipped after it
+            count = 0
+            for kind, loc in iter_sitemap(response.iter_content(64 * 1024)):
+                if kind == 'sitemap':
+                    pending.append(loc)
+                else:
+                    count += 1
+                    yield loc
+            logging.info('SITEMAP - %s - %i URLs', sitemap, count)
+        except (ElementTree.ParseError, zlib.error, requests.RequestException) as err:
+            logging.warning('Cannot parse sitemap %s (%s)', sitemap, err)
+        finally:
+            response.close()
@@ -0,0 +1,187 @@
+"""
+Scope of the crawl: decides whether a link belongs to the crawled site or
+is external.
+
+Host rules are host name suffixes: a rule matches the host and all its
+subdomains, and a rule with a port only matches that port. They are stored
+in a trie of the reversed host labels, so a host is classified in as many
+steps as it has labels, and the most specific rule decides. URL rules are
+path globs and regular expressions, compiled once into a single regular
+expression where the deny rules come first. User regular expressions with
+groups, whose names and numbers would clash in the single expression, or
+with global flags, are searched on their own.
+"""
+import re
+
+# Decisions cached per network location, before the cache is reset
+HOST_CACHE_SIZE = 100000
+# Matches the scheme and network location before the path of a glob
+URL_PREFIX = r'[^:/?#]+://[^/?#]*'
+
+_ALLOW = 'allow'
+_DENY = 'deny'
+
+
+def split_host(netloc):
+    """
+    Splits a network location into its lowercase host and its port.
+
+    :return: A tuple (host, port), the port is None when not given.
+    """
+    hostport = netloc.rpartition('@')[2].lower()
+    if hostport.startswith('['):
+        end = hostport.find(']')
+        host, rest = hostport[:end + 1], hostport[end + 1:]
+        port = rest[1:] if rest.startswith(':') else None
+    else:
+        host, _, port = hostport.partition(':')
+    return host.rstrip('.'), int(port) if port and port.isdigit() else None
+
+
+def glob_regex(glob):
+    """
+    Returns the regular expression of a path glob, matching the whole URL.
+    '*' matches any sequence of characters, '/' included.
+    """
+    path = '.*'.join(re.escape(part) for part in glob.split('*'))
+    return URL_PREFIX + path + r'(?:\?.*)?$'
+
+
+def _combinable(regex):
+    # Groups of a user expression would be renumbered, and its backreferences
+    # broken, in the combined expression; global flags must come first
+    try:
+        return re.compile(f'(?:{regex})').groups == 0
+    except re.error:
+        return False
+
+
+def split_regexes(regexes):
+    """
+    Splits user regular expressions into those that can be combined into
+    one expression and those compiled on their own.
+
+    :return: A tuple (combinable patterns, compiled standalone regexes).
+    :raise re.error: if a regular expression is not valid.
+    """
+    combined, standalone = [], []
+    for regex in regexes:
+        compiled = re.compile(regex)
+        if _combinable(regex):
+            combined.append(regex)
+        else:
+            standalone.append(compiled)
+    return combined, standalone
+
+
+class ScopeMatcher:
+    """
+    Classifies URLs as in scope or external. A URL is in scope when its host
+    is allowed, it matches no deny pattern and, if there are allow patterns,
+    it matches one of them.
+    """
+
+    def __init__(self, allow_hosts=(), deny_hosts=(), allow_paths=(), deny_paths=(),
+                 allow_regexes=(), deny_regexes=()):
+        """
+        :param allow_hosts: Host suffixes in scope, e.g. 'example.com' or 'example.com:8080'.
+        :param deny_hosts: Host suffixes out of scope, winning over the allowed
+            hosts they are a subdomain of.
+        :param allow_paths: Path globs in scope, e.g. '/blog/*'.
+        :param deny_paths: Path globs out of scope.
+        :param allow_regexes: Regular expressions searched in the URLs in scope.
+        :param deny_regexes: Regular expressions searched in the URLs out of scope.
+        :raise re.error: if a regular expression is not valid.
+        """
+        self.trie = {}
+        for rule in allow_hosts:
+            self._add_host(rule, _ALLOW)
+        for rule in deny_hosts:
+            self._add_host(rule, _DENY)
+        self._hosts = {}
+
+        deny_regexes, self.deny_standalone = split_regexes(deny_regexes)
+        allow_regexes, self.allow_standalone = split_regexes(allow_regexes)
+        deny = [glob_regex(glob) for glob in deny_paths]
+        deny += [f'.*?(?:{regex})' for regex in deny_regexes]
+        allow = [glob_regex(glob) for glob in allow_paths]
+        allow += [f'.*?(?:{regex})' for regex in allow_regexes]
+        alternatives = []
+        if deny:
+            alternatives.append('(?P<deny>%s)' % '|'.join(f'(?:{pattern})' for pattern in deny))
+        if allow:
+            alternatives.append('(?P<allow>%s)' % '|'.join(f'(?:{pattern})' for pattern in allow))
+        self.has_allow_patterns = bool(allow or self.allow_standalone)
+        self.matcher = re.compile('|'.join(alternatives), re.DOTALL) if alternatives else None
+
+    def _add_host(self, rule, decision):
+        host, port = split_host(rule.strip().lstrip('*').lstrip('.'))
+        node = self.trie
+        for label in reversed(host.split('.')):
+            node = node.setdefault(label, {})
+        # One decision for any port, under None, or per port
+        node.setdefault('', {})[port] = decision
+
+    def _host_decision(self, netloc):
+        host, port = split_host(netloc)
+        decision = None
+        node = self.trie
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            rules = node.get('')
+            if rules is not None:
+                # Deeper rules are more specific and override the previous ones
+                decision = rules.get(port, rules.get(None, decision))
+        return decision == _ALLOW
+
+    def host_in_scope(self, netloc):
+        """
+        Checks the host rules only.
+
+        :param netloc: Network location of a URL.
+        :return: True if the host is in scope.
+        """
+        in_scope = self._hosts.get(netloc)
+        if in_scope is None:
+            if len(self._hosts) >= HOST_CACHE_SIZE:
+                self._hosts.clear()
+            in_scope = self._hosts[netloc] = self._host_decision(netloc)
+        return in_scope
+
+    def in_scope(self, link):
+        """
+        Classifies a URL.
+
+        :param link: The ParsedUrl record of the URL.
+        :return: True if the URL is in scope, False if it is external.
+        """
+        if not self.host_in_scope(link.netloc):
+            return False
+        if any(regex.search(link.url) for regex in self.deny_standalone):
+            return False
+        if self.matcher is not None:
+            match = self.matcher.match(link.url)
+            if match is not None:
+                return match.lastgroup == 'allow'
+        if any(regex.search(link.url) for regex in self.allow_standalone):
+            return True
+        return not self.has_allow_patterns
+
+
+def create_scope(base_url, args):
+    """
+    Creates the scope of a crawl: the host of the root URL and its
+    subdomains, and the scope options of the command line.
+
+    :param base_url: Network location of the root URL.
+    :param args: Parsed command line arguments.
+    :return: A ScopeMatcher object.
+    """
+    return ScopeMatcher(allow_hosts=[base_url] + list(getattr(args, 'allow_host', None) or []),
+                        deny_hosts=getattr(args, 'deny_host', None) or [],
+                        allow_paths=getattr(args, 'allow_path', None) or [],
+                        deny_paths=getattr(args, 'deny_path', None) or [],
+                        allow_regexes=getattr(args, 'allow_regex', None) or [],
+                        deny_regexes=getattr(args, 'deny_regex', None) or [])
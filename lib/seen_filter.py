@@ -0,0 +1,97 @@
+"""
+Probabilistic seen-filter for the URL dedupe check of huge crawls.
+
+A Bloom filter answers "was this URL seen?" in a fixed amount of memory,
+chosen from the expected number of URLs and the false positive rate. A
+false positive means a new URL is taken as seen and is not crawled; a
+seen URL is never taken as new.
+"""
+import math
+import pickle
+import hashlib
+
+
+class BloomFilter:
+    """
+    Bloom filter over URL strings, with the subset of the set interface
+    used by the crawler for urls_seen (add, update, in and len).
+    """
+
+    def __init__(self, capacity, fp_rate):
+        """
+        :param capacity: Expected number of URLs.
+        :param fp_rate: Acceptable false positive rate once capacity URLs were added.
+        :raise ValueError: if the capacity is not positive or the rate not between 0 and 1.
+        """
+        if capacity < 1:
+            raise ValueError(f'Bloom filter capacity must be positive: {capacity}')
+        if not 0 < fp_rate < 1:
+            raise ValueError(f'Bloom filter false positive rate must be between 0 and 1: {fp_rate}')
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        """
+        Number of distinct URLs added, up to the false positives.
+        """
+        return self.count
+
+    def _positions(self, url):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(url.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, url):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(url))
+
+    def add(self, url):
+        """
+        Adds a URL to the filter.
+        """
+        bits = self.bits
+        is_new = False
+        for position in self._positions(url):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                is_new = True
+        if is_new:
+            self.count += 1
+
+    def update(self, urls):
+        """
+        Adds all the URLs of an iterable to the filter.
+        """
+        for url in urls:
+            self.add(url)
+
+    @property
+    def size(self):
+        """
+        Memory used by the bit array, in bytes.
+        """
+        return len(self.bits)
+
+
+def load_seen_filter(file_name, capacity, fp_rate):
+    """
+    Loads the Bloom filter saved by a previous session, or creates a new
+    empty one if there is none.
+
+    :param file_name: The name of the file to read from.
+    :param capacity: Expected number of URLs of a new filter.
+    :param fp_rate: False positive rate of a new filter.
+    :return: A BloomFilter object.
+    """
+    try:
+        with open(file_name, "rb") as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return BloomFilter(capacity, fp_rate)
@@ -0,0 +1,188 @@
+"""
+Creates the crawl-scoped HTTP session and keeps track of how many
+connections were opened and how many requests reused an existing one.
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool
+from lib.response_cache import CACHEABLE_STATUSES
+from lib.response_cache import cached_response
+from lib.content_encoding import accept_encoding
+from lib.http2 import Http2Adapter
+
+
+class ConnectionStats:
+    """
+    Thread-safe counters of the connections opened and the requests sent
+    through the connection pools of a session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def connection_opened(self):
+        with self._lock:
+            self.opened += 1
+
+    def request_sent(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def reused(self):
+        """
+        Number of requests that were sent over an already open connection.
+        """
+        return max(0, self.requests - self.opened)
+
+
+def _counting_pool_class(base_class, stats, keep_alive):
+    """
+    Returns a subclass of the given urllib3 connection pool class that
+    reports new connections and requests to the stats object.
+    """
+    class CountingConnection(base_class.ConnectionCls):
+        def connect(self):
+            # Dropped connections are reconnected on the same object,
+            # so count the actual connects rather than the new objects.
+            stats.connection_opened()
+            return super().connect()
+
+    class CountingConnectionPool(base_class):
+        ConnectionCls = CountingConnection
+
+        def _make_request(self, *args, **kwargs):
+            stats.request_sent()
+            return super()._make_request(*args, **kwargs)
+
+        def _put_conn(self, conn):
+            if not keep_alive and conn is not None:
+                conn.close()
+            return super()._put_conn(conn)
+
+    return CountingConnectionPool
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools report to a ConnectionStats object.
+    """
+
+    def __init__(self, stats, keep_alive=True, **kwargs):
+        self.stats = stats
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.stats, self.keep_alive),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.stats, self.keep_alive),
+        }
+
+
+class CachingMixin:
+    """
+    Mixin of a transport adapter answering GET and HEAD requests from a
+    ResponseCache when it can, and storing the responses it fetches.
+    The bodies of streamed GET responses are left unread, so that the
+    fetcher still reads them with its size cap and its consumers. Those
+    responses get a `store_body` function, to be called with the whole
+    body once it is read, and only when it is HTML.
+    """
+
+    cache = None
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().send(request, stream=stream, **kwargs)
+
+        stored = self.cache.get(request.method, request.url)
+        if stored is not None:
+            return cached_response(request, *stored)
+
+        response = super().send(request, stream=stream, **kwargs)
+        if response.status_code not in CACHEABLE_STATUSES:
+            return response
+        if 'no-store' in response.headers.get('Cache-Control', ''):
+            return response
+        if request.method == 'GET' and stream:
+            if 'text/html' in response.headers.get('Content-Type', ''):
+                response.store_body = lambda body: self.cache.put('GET', request.url, response.status_code,
+                                                                  response.reason, response.headers, body)
+            return response
+
+        body = response.content if request.method == 'GET' else None
+        self.cache.put(request.method, request.url, response.status_code, response.reason, response.headers, body)
+        return response
+
+
+class CachingHTTPAdapter(CachingMixin, CountingHTTPAdapter):
+    """
+    CountingHTTPAdapter with a response cache.
+    """
+
+    def __init__(self, stats, cache, keep_alive=True, **kwargs):
+        self.cache = cache
+        super().__init__(stats, keep_alive=keep_alive, **kwargs)
+
+
+class CachingHttp2Adapter(CachingMixin, Http2Adapter):
+    """
+    Http2Adapter with a response cache.
+    """
+
+    def __init__(self, stats, cache, **kwargs):
+        self.cache = cache
+        super().__init__(stats, **kwargs)
+
+
+def create_session(pool_hosts=10, pool_maxsize=10, keep_alive=True, cache=None, http2=False, h2c=False):
+    """
+    Creates one requests Session to be shared by the whole crawl.
+
+    :param pool_hosts: Number of per-host connection pools to keep cached.
+    :param pool_maxsize: Maximum number of connections kept open per host.
+        Requests block until a connection of the host is free.
+    :param keep_alive: If False, every connection is closed after one request.
+    :param cache: Optional ResponseCache answering the requests it can.
+    :param http2: If True, send the requests through the HTTP/2 transport,
+        negotiated with ALPN on HTTPS. Needs httpx[http2].
+    :param h2c: If True with http2, also speak HTTP/2 to cleartext servers,
+        with prior knowledge.
+    :return: A requests Session object with a `connection_stats` attribute.
+    """
+    session = requests.Session()
+    stats = ConnectionStats()
+    if http2:
+        # Streams of one connection per host replace the connection pools
+        options = {'max_connections': pool_hosts * pool_maxsize, 'keep_alive': keep_alive, 'prior_knowledge': h2c}
+        if cache is not None:
+            adapter = CachingHttp2Adapter(stats, cache, **options)
+        else:
+            adapter = Http2Adapter(stats, **options)
+    elif cache is not None:
+        adapter = CachingHTTPAdapter(stats,
+                                     cache,
+                                     keep_alive=keep_alive,
+                                     pool_connections=pool_hosts,
+                                     pool_maxsize=pool_maxsize,
+                                     pool_block=True)
+    else:
+        adapter = CountingHTTPAdapter(stats,
+                                      keep_alive=keep_alive,
+                                      pool_connections=pool_hosts,
+                                      pool_maxsize=pool_maxsize,
+                                      pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    # Only the encodings that can be decoded while streaming the bodies
+    session.headers['Accept-Encoding'] = accept_encoding()
+    session.connection_stats = stats
+    return session
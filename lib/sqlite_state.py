@@ -0,0 +1,343 @@
+"""
+SQLite backend for the crawl state.
+
+All the URLs of a crawl live in one indexed table, with their status in the
+crawl, depth, content type, size and timings. The frontier and the URL sets
+of the crawler are views on that table, so resuming a session does not load
+anything in memory, and the results can be queried with SQL.
+"""
+import os
+import time
+import sqlite3
+
+# Membership of a URL in the crawl sets, stored as bits of the flags column
+SEEN = 1
+PARSED = 2
+FAILED = 4
+EXTERN = 8
+ERRORS = 16
+FILES = 32
+
+# Status of a URL, the last set it was added to
+STATUS_NAMES = {
+    SEEN: 'seen',
+    PARSED: 'parsed',
+    FAILED: 'failed',
+    EXTERN: 'extern',
+    ERRORS: 'errors',
+    FILES: 'files',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    flags INTEGER NOT NULL DEFAULT 0,
+    queue_position INTEGER,
+    depth INTEGER,
+    http_status INTEGER,
+    content_type TEXT,
+    size INTEGER,
+    elapsed REAL,
+    updated REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS urls_queue ON urls (queue_position) WHERE queue_position IS NOT NULL;
+CREATE INDEX IF NOT EXISTS urls_http_status ON urls (http_status);
+CREATE INDEX IF NOT EXISTS urls_size ON urls (size);
+DROP INDEX IF EXISTS urls_status;
+DROP INDEX IF EXISTS urls_content_type;
+CREATE TABLE IF NOT EXISTS crawling (
+    url TEXT PRIMARY KEY,
+    depth INTEGER
+) WITHOUT ROWID;
+"""
+
+
+class SqliteState:
+    """
+    Crawl state stored in a SQLite database in WAL mode. Writes are grouped
+    in transactions, committed once batch_size changes are pending and a
+    URL is completely processed, so that a crash never keeps the result of
+    a URL without its outlinks. The URLs taken from the queue are kept in
+    the crawling table until they are done, for the URLs processed by the
+    other workers at the time of a commit.
+    """
+
+    def __init__(self, file_name, resume=False, batch_size=1000):
+        """
+        :param file_name: The database file.
+        :param resume: If True, continue the session stored in the database,
+            otherwise start from an empty one.
+        :param batch_size: Number of changes committed together.
+        """
+        if not resume:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(file_name + suffix):
+                    os.remove(file_name + suffix)
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.changes = 0
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+        self.queue = SqliteQueue(self)
+        self.sets = {flag: SqliteSet(self, flag) for flag in STATUS_NAMES}
+
+        # URLs being crawled when the previous session died go first, then the
+        # seen URLs that are neither queued nor in any other set
+        pending = self.connection.execute('SELECT url, depth FROM crawling').fetchall()
+        pending += self.connection.execute(
+            'SELECT url, depth FROM urls WHERE flags = ? AND queue_position IS NULL', (SEEN,)).fetchall()
+        self.connection.execute('DELETE FROM crawling')
+        for url, depth in reversed(pending):
+            self.queue.appendleft(url, depth or 0)
+        self.commit()
+
+    def count(self, flag):
+        """
+        Returns the number of URLs in one of the sets.
+        """
+        return self.connection.execute('SELECT COUNT(*) FROM urls WHERE flags & ?', (flag,)).fetchone()[0]
+
+    def changed(self):
+        """
+        Counts one change, committed later by checkpoint().
+        """
+        self.changes += 1
+
+    def checkpoint(self):
+        """
+        Commits the pending changes when the batch is full. Only called
+        between two URLs, once all the changes of a URL are made.
+        """
+        if self.changes >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """
+        Commits the pending changes.
+        """
+        self.connection.commit()
+        self.changes = 0
+
+    def add_flag(self, url, flag):
+        """
+        Adds a URL to one of the sets and makes it the status of the URL,
+        except for the seen-set which does not change the status.
+
+        :return: True if the URL was not in the set yet.
+        """
+        if flag == SEEN:
+            cursor = self.connection.execute(
+                'UPDATE urls SET flags = flags | ? WHERE url = ? AND NOT flags & ?', (flag, url, flag))
+        else:
+            cursor = self.connection.execute(
+                'UPDATE urls SET flags = flags | ?, status = ?, updated = ? WHERE url = ? AND NOT flags & ?',
+                (flag, STATUS_NAMES[flag], time.time(), url, flag))
+        if not cursor.rowcount:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO urls (url, status, flags, updated) VALUES (?, ?, ?, ?)',
+                (url, STATUS_NAMES[flag], flag, time.time()))
+        self.changed()
+        return bool(cursor.rowcount)
+
+    def has_flag(self, url, flag):
+        """
+        Returns True if the URL is in one of the sets.
+        """
+        row = self.connection.execute('SELECT flags FROM urls WHERE url = ?', (url,)).fetchone()
+        return row is not None and bool(row[0] & flag)
+
+    def record_result(self, result):
+        """
+        Stores the response details of a crawled URL.
+
+        :param result: Dict with the 'url', 'http_status', 'content_type', 'size' and 'elapsed' keys,
+            among the result keys of the engine.
+        """
+        self.connection.execute(
+            'UPDATE urls SET http_status = ?, content_type = ?, size = ?, elapsed = ? WHERE url = ?',
+            (result['http_status'], result['content_type'], result['size'], result['elapsed'], result['url']))
+        self.changed()
+
+    def close(self):
+        """
+        Commits the pending changes and closes the database.
+        """
+        self.commit()
+        self.connection.close()
+
+
+class SqliteSet:
+    """
+    One of the crawl sets, as a view on the urls table. Supports the subset
+    of the set interface used by the crawler.
+    """
+
+    def __init__(self, state, flag):
+        self.state = state
+        self.flag = flag
+        self.length = state.count(flag)
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, url):
+        return self.state.has_flag(url, self.flag)
+
+    def __iter__(self):
+        cursor = self.state.connection.execute('SELECT url FROM urls WHERE flags & ?', (self.flag,))
+        return (row[0] for row in cursor)
+
+    def add(self, url):
+        """
+        Adds a URL to the set.
+        """
+        if self.state.add_flag(url, self.flag):
+            self.length += 1
+
+    def update(self, urls):
+        """
+        Adds all the URLs of an iterable to the set.
+        """
+        for url in urls:
+            self.add(url)
+
+
+class SqliteQueue:
+    """
+    The frontier, as the URLs of the urls table with a queue position.
+    Supports the subset of the deque interface used by the crawler.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        connection = state.connection
+        self.length = connection.execute(
+            'SELECT COUNT(*) FROM urls WHERE queue_position IS NOT NULL').fetchone()[0]
+        first, last = connection.execute(
+            'SELECT MIN(queue_position), MAX(queue_position) FROM urls WHERE queue_position IS NOT NULL').fetchone()
+        self.first = first if first is not None else 0
+        self.last = last if last is not None else -1
+
+    def __len__(self):
+        return self.length
+
+    def _enqueue(self, url, position, depth):
+        connection = self.state.connection
+        cursor = connection.execute(
+            "UPDATE urls SET queue_position = ?, depth = ?, status = 'queued' WHERE url = ? AND queue_position IS NULL",
+            (position, depth, url))
+        if not cursor.rowcount:
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO urls (url, status, flags, queue_position, depth, updated) VALUES (?, ?, 0, ?, ?, ?)',
+                (url, 'queued', position, depth, time.time()))
+        self.state.changed()
+        if cursor.rowcount:
+            self.length += 1
+            return True
+        return False
+
+    def append(self, url, depth=0):
+        """
+        Adds a URL at the end of the queue.
+        """
+        if self._enqueue(url, self.last + 1, depth):
+            self.last += 1
+
+    def appendleft(self, url, depth=0):
+        """
+        Adds a URL at the front of the queue.
+        """
+        if self._enqueue(url, self.first - 1, depth):
+            self.first -= 1
+
+    def popleft_entry(self):
+        """
+        Removes the URL at the front of the queue and returns it with its depth.
+        """
+        connection = self.state.connection
+        row = connection.execute(
+            'SELECT url, queue_position, depth FROM urls WHERE queue_position IS NOT NULL '
+            'ORDER BY queue_position LIMIT 1').fetchone()
+        if row is None:
+            raise IndexError('pop from an empty queue')
+        connection.execute("UPDATE urls SET queue_position = NULL, status = 'crawling' WHERE url = ?", (row[0],))
+        connection.execute('INSERT OR REPLACE INTO crawling (url, depth) VALUES (?, ?)', (row[0], row[2]))
+        self.state.changed()
+        self.length -= 1
+        self.first = row[1] + 1
+        return row[0], row[2] or 0
+
+    def popleft(self):
+        """
+        Removes and returns the URL at the front of the queue.
+        """
+        return self.popleft_entry()[0]
+
+    def task_done(self, url):
+        """
+        Records that a URL taken from the queue was completely processed,
+        its outlinks included, and commits the batch if it is full.
+        """
+        self.state.connection.execute('DELETE FROM crawling WHERE url = ?', (url,))
+        self.state.changed()
+        self.state.checkpoint()
+
+
+def query_urls(file_name, status=None, content_type=None, min_size=None, max_size=None, http_status=None):
+    """
+    Queries the URLs of a crawl stored in a SQLite database. The queued, HTTP
+    status and size filters use the indexes of the urls table. The other
+    statuses are bits of the flags column, since a URL can be in several sets,
+    and the content type is matched as a substring, so these filters are
+    checked on each row the indexes leave, or on the whole table without them.
+
+    :param file_name: The database file.
+    :param status: Status of the URLs ('parsed', 'files', 'failed', 'extern', 'errors', 'queued').
+    :param content_type: Substring of the content type, e.g. 'pdf'.
+    :param min_size: Minimum size in bytes.
+    :param max_size: Maximum size in bytes.
+    :param http_status: HTTP status code, or class of codes such as '5xx'.
+    :return: A generator of rows (url, status, depth, http_status, content_type, size, elapsed).
+    """
+    conditions = []
+    parameters = []
+    if status == 'queued':
+        conditions.append('queue_position IS NOT NULL')
+    elif status is not None:
+        flag = {name: flag for flag, name in STATUS_NAMES.items()}[status]
+        conditions.append('flags & ?')
+        parameters.append(flag)
+    if content_type is not None:
+        conditions.append('content_type LIKE ?')
+        parameters.append(f'%{content_type}%')
+    if min_size is not None:
+        conditions.append('size >= ?')
+        parameters.append(min_size)
+    if max_size is not None:
+        conditions.append('size <= ?')
+        parameters.append(max_size)
+    if http_status is not None:
+        http_status = str(http_status).lower()
+        if http_status.endswith('xx'):
+            conditions.append('http_status BETWEEN ? AND ?')
+            parameters.extend((int(http_status[0]) * 100, int(http_status[0]) * 100 + 99))
+        else:
+            conditions.append('http_status = ?')
+            parameters.append(int(http_status))
+
+    sql = 'SELECT url, status, depth, http_status, content_type, size, elapsed FROM urls'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY url'
+
+    if not os.path.exists(file_name):
+        raise FileNotFoundError(file_name)
+    connection = sqlite3.connect(f'file:{file_name}?mode=ro', uri=True)
+    try:
+        yield from connection.execute(sql, parameters)
+    finally:
+        connection.close()
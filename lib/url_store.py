@@ -0,0 +1,247 @@
+"""
+Memory-compact storage of URLs for very large crawls.
+
+Each URL is interned once into an append-only byte arena and gets an
+integer ID. The crawl sets only keep bitsets of IDs and the frontier
+only keeps an array of IDs, so a URL found in several sets is stored once
+and costs a few bytes per set instead of a full Python string.
+"""
+from array import array
+from lib.frontier import MAX_DEPTH
+
+EMPTY_SLOT = -1
+# Grow the hash table when it is more than half full
+MAX_LOAD_FACTOR = 0.5
+
+
+def _encode(url):
+    return url.encode('utf-8', 'surrogatepass')
+
+
+class UrlStore:
+    """
+    Append-only arena of interned URLs, indexed by an open addressing hash
+    table of IDs. URLs are never removed, so IDs stay valid for the whole crawl.
+    """
+
+    def __init__(self, capacity=1024):
+        """
+        :param capacity: Initial number of slots of the hash table, a power of two.
+        """
+        self.arena = bytearray()
+        self.offsets = array('q', [0])
+        self.hashes = array('q')
+        self.table = array('q', [EMPTY_SLOT]) * capacity
+        self.mask = capacity - 1
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _find(self, data, data_hash):
+        """
+        Probes the hash table for the given encoded URL.
+
+        :return: A tuple (slot, url_id), url_id is EMPTY_SLOT if not found.
+        """
+        table, offsets, hashes, arena = self.table, self.offsets, self.hashes, self.arena
+        slot = data_hash & self.mask
+        while True:
+            url_id = table[slot]
+            if url_id == EMPTY_SLOT:
+                return slot, EMPTY_SLOT
+            if hashes[url_id] == data_hash and arena[offsets[url_id]:offsets[url_id + 1]] == data:
+                return slot, url_id
+            slot = (slot + 1) & self.mask
+
+    def _grow(self):
+        capacity = (self.mask + 1) * 2
+        self.table = array('q', [EMPTY_SLOT]) * capacity
+        self.mask = capacity - 1
+        table, mask = self.table, self.mask
+        for url_id, data_hash in enumerate(self.hashes):
+            slot = data_hash & mask
+            while table[slot] != EMPTY_SLOT:
+                slot = (slot + 1) & mask
+            table[slot] = url_id
+
+    def intern(self, url):
+        """
+        Returns the ID of a URL, adding it to the arena if it is new.
+
+        :param url: URL to intern.
+        :return: The integer ID of the URL.
+        """
+        data = _encode(url)
+        data_hash = hash(data)
+        slot, url_id = self._find(data, data_hash)
+        if url_id != EMPTY_SLOT:
+            return url_id
+
+        url_id = len(self.hashes)
+        self.arena += data
+        self.offsets.append(len(self.arena))
+        self.hashes.append(data_hash)
+        self.table[slot] = url_id
+        if len(self.hashes) > (self.mask + 1) * MAX_LOAD_FACTOR:
+            self._grow()
+        return url_id
+
+    def lookup(self, url):
+        """
+        Returns the ID of a URL without adding it.
+
+        :param url: URL to look for.
+        :return: The integer ID of the URL or None if it was never interned.
+        """
+        data = _encode(url)
+        url_id = self._find(data, hash(data))[1]
+        return None if url_id == EMPTY_SLOT else url_id
+
+    def url(self, url_id):
+        """
+        Returns the URL of an ID.
+
+        :param url_id: Integer ID returned by intern().
+        :return: The URL string.
+        """
+        return self.arena[self.offsets[url_id]:self.offsets[url_id + 1]].decode('utf-8', 'surrogatepass')
+
+
+class UrlSet:
+    """
+    Set of URLs stored as a bitset of IDs of a shared UrlStore. Supports the
+    subset of the set interface used by the crawler.
+    """
+
+    def __init__(self, store, urls=()):
+        """
+        :param store: The UrlStore shared by all the sets of the crawl.
+        :param urls: Optional iterable of URLs to add.
+        """
+        self.store = store
+        self.bits = bytearray()
+        self.count = 0
+        self.update(urls)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, url):
+        url_id = self.store.lookup(url)
+        if url_id is None or url_id >> 3 >= len(self.bits):
+            return False
+        return bool(self.bits[url_id >> 3] & (1 << (url_id & 7)))
+
+    def __iter__(self):
+        store = self.store
+        for index, byte in enumerate(self.bits):
+            if not byte:
+                continue
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield store.url((index << 3) | bit)
+
+    def add(self, url):
+        """
+        Adds a URL to the set.
+        """
+        url_id = self.store.intern(url)
+        index, mask = url_id >> 3, 1 << (url_id & 7)
+        if index >= len(self.bits):
+            # Grow in steps to amortize the copies
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits) // 2)))
+        if not self.bits[index] & mask:
+            self.bits[index] |= mask
+            self.count += 1
+
+    def discard(self, url):
+        """
+        Removes a URL from the set if it is present.
+        """
+        if url in self:
+            url_id = self.store.lookup(url)
+            self.bits[url_id >> 3] &= ~(1 << (url_id & 7)) & 0xff
+            self.count -= 1
+
+    def update(self, urls):
+        """
+        Adds all the URLs of an iterable to the set.
+        """
+        for url in urls:
+            self.add(url)
+
+
+class UrlQueue:
+    """
+    FIFO queue of URLs stored as an array of IDs of a shared UrlStore, with
+    the depth of each URL in a parallel array of unsigned shorts. Supports
+    the subset of the deque interface used by the crawler.
+    """
+
+    def __init__(self, store, entries=()):
+        """
+        :param store: The UrlStore shared by all the sets of the crawl.
+        :param entries: Optional iterable of (url, depth) tuples to append.
+        """
+        self.store = store
+        self.ids = array('q')
+        self.depths = array('H')
+        self.head = 0
+        for url, depth in entries:
+            self.append(url, depth)
+
+    def __len__(self):
+        return len(self.ids) - self.head
+
+    def __iter__(self):
+        for index in range(self.head, len(self.ids)):
+            yield self.store.url(self.ids[index])
+
+    def entries(self):
+        """
+        Returns an iterator of the (url, depth) tuples of the queue, in order.
+        """
+        for index in range(self.head, len(self.ids)):
+            yield self.store.url(self.ids[index]), self.depths[index]
+
+    def append(self, url, depth=0):
+        """
+        Adds a URL at the end of the queue.
+        """
+        self.ids.append(self.store.intern(url))
+        self.depths.append(min(depth, MAX_DEPTH))
+
+    def appendleft(self, url, depth=0):
+        """
+        Adds a URL at the front of the queue.
+        """
+        url_id = self.store.intern(url)
+        if self.head > 0:
+            self.head -= 1
+            self.ids[self.head] = url_id
+            self.depths[self.head] = min(depth, MAX_DEPTH)
+        else:
+            self.ids.insert(0, url_id)
+            self.depths.insert(0, min(depth, MAX_DEPTH))
+
+    def popleft_entry(self):
+        """
+        Removes the URL at the front of the queue and returns it with its depth.
+        """
+        if self.head >= len(self.ids):
+            raise IndexError('pop from an empty queue')
+        url = self.store.url(self.ids[self.head])
+        depth = self.depths[self.head]
+        self.head += 1
+        # Drop the consumed IDs once they are half of the array
+        if self.head > 1024 and self.head * 2 > len(self.ids):
+            del self.ids[:self.head]
+            del self.depths[:self.head]
+            self.head = 0
+        return url, depth
+
+    def popleft(self):
+        """
+        Removes and returns the URL at the front of the queue.
+        """
+        return self.popleft_entry()[0]
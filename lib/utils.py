@@ -2,10 +2,19 @@
 Set of common util functions to supopr the
 functionality of the web crawler
 """
+import re
 import pickle
 import argparse
 from collections import deque
 from urllib.parse import urlparse
+from lib.url_store import UrlSet
+from lib.url_store import UrlQueue
+from lib.frontier import MemoryFrontier
+from lib.canonical import ParsedUrl
+from lib.export import FORMATS
+from lib.export import COMPRESSIONS
+from lib.request_log import FORMATS as LOG_FORMATS
+from lib.canonical import parse_url
 
 
 def create_parser():
@@ -18,18 +27,125 @@ def create_parser():
     parser.add_argument('-D', '--debug', action='store_true', help='Debug')
     parser.add_argument('-r', '--resume', action='store_true', help='Resume existing crawling session')
     parser.add_argument('-u', '--url', required=True, type=str, help='URL to start crawling')
-    parser.add_argument('-w', '--write', action='store_true', help='Save crawl output to a local file')
-    parser.add_argument('-L', '--common-log-format', default=False, action='store_true', help='Generate log of the requests in CLF')
-    parser.add_argument('-e', '--export-file-list', default=False, action='store_true', help='Creates a file with all the URLs to found files during crawling')
+    parser.add_argument('-w', '--write', action='store_true', help='Save crawl output to a local file: one record per crawled URL (status, type, size, depth, latency, parent), written to logs/<site>_results.<format> while crawling')
+    parser.add_argument('-L', '--common-log-format', default=False, action='store_true', help='Generate log of the requests in CLF, logs/<site>_requests.log, written by a background thread')
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='common', help='Format of the request log: common (CLF) or combined (CLF with referer and user agent). Default: common')
+    parser.add_argument('--log-queue', type=int, default=10000, help='Request log lines waiting to be written, beyond which lines are dropped rather than slowing the crawl. Default: 10000')
+    parser.add_argument('-e', '--export-file-list', default=False, action='store_true', help='Creates a file with all the URLs to found files during crawling, logs/<site>_files.<format>, written while crawling')
+    parser.add_argument('--export-format', choices=FORMATS, default='jsonl', help='Format of the --write and --export-file-list files (parquet needs pyarrow). Default: jsonl')
+    parser.add_argument('--export-compression', choices=COMPRESSIONS, default='none', help='Compression of the exported files. Default: none')
+    parser.add_argument('--export-buffer', type=int, default=100, help='Records written together to the exported files. Default: 100')
     parser.add_argument('-l', '--crawl-limit', type=int, default=float('inf'), help='Maximum links to crawl')
-    parser.add_argument('-C', '--crawl-depth', type=int, default=float('inf'), help='Limit the crawling depth according to the value specified')
+    parser.add_argument('-C', '--crawl-depth', type=int, default=float('inf'), help='Limit the crawling depth according to the value specified (number of links followed from the root URL)')
     parser.add_argument('-d', '--download-file', type=str, default=False, help='Specify the file type of the files to download')
     parser.add_argument('-i', '--interactive-download', default=False, action='store_true', help='Before downloading files allow user to specify manually the type of files to download')
     parser.add_argument('-U', '--username', type=str, help='User name for authentication')
     parser.add_argument('-P', '--password', type=str, help='Request password for authentication')
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help='Number of URLs fetched and parsed concurrently')
+    parser.add_argument('--pool-hosts', type=int, default=10, help='Number of per-host connection pools kept open')
+    parser.add_argument('--pool-maxsize', type=int, default=None, help='Maximum connections per host (default: same as --concurrency)')
+    parser.add_argument('--cache', default=False, action='store_true', help='Answer the requests from an on-disk response cache (logs/response_cache.db) and store the fetched responses in it')
+    parser.add_argument('--cache-ttl', type=int, default=86400, help='Seconds after which a cached response is fetched again')
+    parser.add_argument('--cache-size', type=parse_size, default='1G', help='Maximum size of the compressed bodies of the response cache, e.g. 500M')
+    parser.add_argument('--recrawl', default=False, action='store_true', help='Keep the ETag, Last-Modified, content hash and outlinks of each page, and send conditional requests for the pages of the previous crawls, reusing the outlinks of the unchanged ones')
+    parser.add_argument('--robots', choices=['ignore', 'obey'], default='ignore', help='robots.txt handling: ignore it, or obey its rules when queueing URLs (fetched once per host)')
+    parser.add_argument('--sitemaps', default=False, action='store_true', help='Seed the frontier with the URLs of the sitemaps listed in robots.txt, or of /sitemap.xml')
+    parser.add_argument('--allow-host', action='append', metavar='HOST', help='Host suffix in scope besides the host of the root URL, e.g. example.org or cdn.example.org:8080 (repeatable)')
+    parser.add_argument('--deny-host', action='append', metavar='HOST', help='Host suffix out of scope, overriding the less specific allowed hosts (repeatable)')
+    parser.add_argument('--allow-path', action='append', metavar='GLOB', help='Path glob in scope, e.g. /blog/*. When given, the other paths are external (repeatable)')
+    parser.add_argument('--deny-path', action='append', metavar='GLOB', help='Path glob out of scope (repeatable)')
+    parser.add_argument('--allow-regex', action='append', metavar='REGEX', help='Regular expression of the URLs in scope (repeatable)')
+    parser.add_argument('--deny-regex', action='append', metavar='REGEX', help='Regular expression of the URLs out of scope (repeatable)')
+    parser.add_argument('--dns-ttl', type=int, default=300, help='Seconds a DNS resolution is cached for the whole crawl, 0 to disable the cache. Default: 300')
+    parser.add_argument('--dns-negative-ttl', type=int, default=60, help='Seconds a failed DNS resolution is cached. Default: 60')
+    parser.add_argument('--http2', default=False, action='store_true', help='Fetch over HTTP/2, negotiated on HTTPS, with one multiplexed connection per host (needs httpx[http2])')
+    parser.add_argument('--h2c', default=False, action='store_true', help='With --http2, also use HTTP/2 on http:// URLs, for servers known to speak cleartext HTTP/2')
+    parser.add_argument('--rate', type=float, default=None, help='Maximum requests per second per host, backed off on 429/503 and ramped up again while latency is healthy (default: no limit)')
+    parser.add_argument('--burst', type=int, default=1, help='Requests a host may get at once after being idle, with --rate')
+    parser.add_argument('--latency-target', type=float, default=1.0, help='Response time in seconds under which a host is healthy and its rate ramps up, with --rate')
+    parser.add_argument('--no-keep-alive', default=False, action='store_true', help='Close the connection after each request')
+    parser.add_argument('--url-store', choices=['set', 'compact'], default='set', help='Storage of the crawl URLs: set (Python sets) or compact (interned byte arena, for multi-million URL crawls)')
+    parser.add_argument('--frontier', choices=['memory', 'disk'], default='memory', help='Frontier queue: memory (a deque) or disk (spills to segment files beyond --frontier-memory URLs)')
+    parser.add_argument('--frontier-memory', type=int, default=100000, help='URLs kept in memory by the disk frontier')
+    parser.add_argument('--frontier-segment', type=int, default=10000, help='URLs per segment file of the disk frontier')
+    parser.add_argument('--state', choices=['pickle', 'sqlite'], default='pickle', help='Crawl state backend: pickle (session files) or sqlite (indexed database, see the query subcommand)')
+    parser.add_argument('--state-batch', type=int, default=1000, help='Changes committed together by the sqlite state backend')
+    parser.add_argument('--journal', default=False, action='store_true', help='Record the crawl state in an append-only journal while crawling, instead of storing it only at the end')
+    parser.add_argument('--journal-batch', type=int, default=1000, help='Journal events buffered before being written')
+    parser.add_argument('--journal-compact', type=int, default=100000, help='Journal events after which the state is snapshotted and the journal truncated')
+    parser.add_argument('--seen-filter', choices=['exact', 'bloom'], default='exact', help='Dedupe check of seen URLs: exact (a set) or bloom (fixed memory, probabilistic)')
+    parser.add_argument('--seen-capacity', type=int, default=1000000, help='Expected number of URLs, sizes the bloom seen-filter')
+    parser.add_argument('--seen-fp-rate', type=parse_rate, default=0.001, help='False positive rate of the bloom seen-filter')
+    parser.add_argument('--parser', choices=['bs4', 'stream'], default='bs4', help='Link extractor backend: bs4 (BeautifulSoup) or stream (streaming tokenizer, no DOM)')
+    parser.add_argument('--max-page-size', type=parse_size, default=None, help='Maximum bytes read from a page, the rest is dropped, e.g. 5M (default: no limit)')
+    parser.add_argument('--max-compression-ratio', type=int, default=100, help='Drop compressed pages expanding more than this many times (decompression bombs)')
+    parser.add_argument('--parse-workers', type=int, default=0, help='Number of processes parsing HTML (default: parse in the crawl thread)')
+    parser.add_argument('--parse-queue', type=int, default=None, help='Maximum pages waiting to be parsed (default: twice --parse-workers)')
+    parser.add_argument('--head-mode', choices=['always', 'never', 'auto'], default='auto', help='When to send a HEAD request before the GET: always, never (single streamed GET) or auto (learned per extension and path)')
     return parser
 
 
+def create_query_parser():
+    """
+    Creates and returns the argparse parser of the query subcommand, which lists
+    the URLs of a crawl stored with the sqlite state backend.
+    """
+    parser = argparse.ArgumentParser(prog='crawler.py query', description="Query the URLs of a crawl stored with --state sqlite.")
+    parser.add_argument('-u', '--url', required=True, type=str, help='URL the crawl started from')
+    parser.add_argument('-s', '--status', choices=['queued', 'parsed', 'files', 'failed', 'extern', 'errors'], help='Only URLs with this status')
+    parser.add_argument('-t', '--content-type', type=str, help='Only URLs whose content type contains this text, e.g. pdf')
+    parser.add_argument('--min-size', type=parse_size, help='Only URLs of at least this size, e.g. 1M')
+    parser.add_argument('--max-size', type=parse_size, help='Only URLs of at most this size, e.g. 10K')
+    parser.add_argument('--http-status', type=parse_http_status, help='Only URLs with this HTTP status code, or class of codes such as 5xx')
+    return parser
+
+
+def parse_size(size):
+    """
+    Converts a size such as 512, 10K, 1M or 2G to a number of bytes.
+
+    :param size: The size as a string.
+    :return: The size in bytes.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def parse_rate(rate):
+    """
+    Converts a rate such as 0.001 to a float, strictly between 0 and 1.
+
+    :param rate: The rate as a string.
+    :return: The rate.
+    :raise argparse.ArgumentTypeError: if the rate is not between 0 and 1.
+    """
+    try:
+        value = float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid rate: {rate}')
+    if not 0 < value < 1:
+        raise argparse.ArgumentTypeError(f'rate must be between 0 and 1, exclusive: {rate}')
+    return value
+
+
+def parse_http_status(status):
+    """
+    Checks an HTTP status filter: a code such as 404, or a class of codes
+    such as 5xx.
+
+    :param status: The status as a string.
+    :return: The status, lowercased.
+    :raise argparse.ArgumentTypeError: if the status is neither NNN nor Nxx.
+    """
+    status = status.strip().lower()
+    if not re.fullmatch(r'[1-5](?:\d\d|xx)', status):
+        raise argparse.ArgumentTypeError(f'invalid HTTP status, expected a code such as 404 or a class such as 5xx: {status}')
+    return status
+
+
 def is_valid_url(url):
     """
     Validates if the given URL has a valid format.
@@ -41,29 +157,30 @@ def is_valid_url(url):
     return bool(parsed.scheme) and bool(parsed.netloc)
 
 
-def add_url_to_queue(url, url_queue, url_seen_set):
+def add_url_to_queue(url, url_queue, url_seen_set, depth=0):
     """
-    Adds a URL to the queue after validating and normalizing it, and ensuring it's not a duplicate.
+    Adds a URL to the queue after validating and canonicalizing it, and ensuring it's not a duplicate.
 
-    :param url: URL to add.
-    :param url_queue: Queue (deque) to add the URL to.
+    :param url: URL to add, or its ParsedUrl record if it was already parsed.
+    :param url_queue: Queue (frontier) to add the URL to.
+    :param depth: Number of links followed from the root URL to reach the URL.
     """
-    url = url.strip().lower()
-    if is_valid_url(url):
-        url_seen_set.add(url)
-        url_queue.append(url)
+    link = url if isinstance(url, ParsedUrl) else parse_url(url)
+    if link.valid:
+        url_seen_set.add(link.url)
+        url_queue.append(link.url, depth)
 
 
 def add_url_to_set(url, url_set):
     """
-    Adds a URL to the set after validating and normalizing it.
+    Adds a URL to the set after validating and canonicalizing it.
 
-    :param url: URL to add.
+    :param url: URL to add, or its ParsedUrl record if it was already parsed.
     :param url_set: Set to add the URL to.
     """
-    url = url.strip().lower()
-    if is_valid_url(url) and url not in url_set:
-        url_set.add(url)
+    link = url if isinstance(url, ParsedUrl) else parse_url(url)
+    if link.valid and link.url not in url_set:
+        url_set.add(link.url)
 
 
 def store_set_to_file(set_to_save_to_disk, output_directory, file_name):
@@ -75,6 +192,12 @@ def store_set_to_file(set_to_save_to_disk, output_directory, file_name):
     :param file_name: The name of the file to write to.
     """
 
+    # Compact containers are stored as plain ones to keep the files compatible
+    if isinstance(set_to_save_to_disk, UrlQueue):
+        set_to_save_to_disk = MemoryFrontier(set_to_save_to_disk.entries())
+    elif isinstance(set_to_save_to_disk, UrlSet):
+        set_to_save_to_disk = set(set_to_save_to_disk)
+
     output_filename = f"{output_directory}/{file_name}.log"
     with open(output_filename, "wb") as file:
         pickle.dump(set_to_save_to_disk, file)
@@ -100,22 +223,41 @@ def load_set_from_file(file_name, urls_seen_set):
     return loaded_set
 
 
-def load_queue_from_file(file_name, urls_seen_set):
+def load_parents_from_file(file_name):
     """
-    Loads the contents of a file into a deque (queue).
+    Loads the parents of the queued URLs, stored with the session.
 
     :param file_name: The name of the file to read from.
-    :return: A deque containing the lines of the file.
+    :return: A dict of the queued URLs to the page they were found in, empty
+        if the session was stored without it.
     """
-    loaded_queue = deque()
     try:
         with open(file_name, "rb") as file:
             return pickle.load(file)
     except FileNotFoundError:
-        return deque()  # Return an empty deque in case of an unpickling error
+        return {}
+
+
+def load_queue_from_file(file_name, urls_seen_set):
+    """
+    Loads the contents of a file into a frontier queue.
+
+    :param file_name: The name of the file to read from.
+    :return: A MemoryFrontier containing the URLs of the file and their depth.
+    """
+    loaded_queue = MemoryFrontier()
+    try:
+        with open(file_name, "rb") as file:
+            loaded_queue = pickle.load(file)
+    except FileNotFoundError:
+        return MemoryFrontier()  # Return an empty queue in case of an unpickling error
     except pickle.UnpicklingError:
         print(f"Error loading the queue from {file_name}. File may be corrupted.")
-        return deque()  # Return an empty deque in case of an unpickling error
+        return MemoryFrontier()  # Return an empty queue in case of an unpickling error
+
+    if isinstance(loaded_queue, deque):
+        # Sessions stored without depths restart them from the root
+        loaded_queue = MemoryFrontier((url, 0) for url in loaded_queue)
 
     for url in loaded_queue:
         urls_seen_set.add(url)